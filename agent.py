@@ -5,12 +5,20 @@ Authors:
     Sanyam Mehra (CS229 teaching staff): HW4 solutions
 """
 
+import threading
+import time
+
 import numpy as np
 
+from mdp import SparseTransitions, StateBinning, OBSTACLE_TYPES
+from solvers import solve
+from translog import RECORD_DTYPE, encode_states
+
 # handled type of obstacles
-OBSTACLE_TYPES = {'CACTUS_SMALL': 0, 'CACTUS_LARGE': 1, 'PTERODACTYL': 2}
 MAX_CONSECUTIVE_OBS = 3
 PTERODACTYL_HEIGHTS = [50, 75, 100]
+# number of transitions buffered before updating the approximate MDP
+EPISODE_BUFFER_SIZE = 4096
 
 class AIAgent:
     """AI agent controlling the Dino.
@@ -23,7 +31,20 @@ class AIAgent:
         'args' (ArgumentParser): parser gethering all the Game parameters
         'gamma' (float): discount factor
         'eps' (float): epsilon-greedy coefficient
+        'solver' (str): algorithm solving the approximate MDP, see 'solvers.SOLVERS'
+        'solve_stats' (dict): statistics of the last solve: number of iterations, residual and wall time
+        'policy' (list of int): cached greedy action in each discretized state, None if outdated
+        'q_values' (np.array, [num_states, 2]): cached expected next state value of each (state, action) pair
         'mdp' (MDP): approximate MDP current parameters
+        'binning' (StateBinning): mapping from the states of the Dino to the discretized states
+        'transition_logger' (TransitionLogger): logs the observed transitions, None if not logging
+        'episode' (list of tuple): preallocated buffer of the transitions (state, action, new_state, reward, isCrashed) of the current simulation
+        'n_episode' (int): number of transitions in the buffer
+        
+        'async_solve' (bool): whether the MDP is solved in the background while the next simulation is played
+        'solve_thread' (threading.Thread): background solve in progress, None if there is none
+        'solution' (tuple): result of the background solve (value, q_values, policy, solve_stats) waiting to be swapped in, None if there is none
+        'n_steps' (int): number of actions chosen since the creation of the agent
         
         'dino' (Dino): Dino controller
         
@@ -40,6 +61,21 @@ class AIAgent:
         self.gamma = args.gamma
         self.eps = args.eps
         self.tolerance = args.tolerance
+        self.solver = args.solver
+        self.solve_stats = None
+        # cached greedy policy
+        self.policy = None
+        self.q_values = None
+        # raw experience log
+        self.transition_logger = None
+        # transitions of the current simulation
+        self.episode = [None] * EPISODE_BUFFER_SIZE
+        self.n_episode = 0
+        # background solve
+        self.async_solve = args.async_solve
+        self.solve_thread = None
+        self.solution = None
+        self.n_steps = 0
         # initialize the approximate MDP parameters
         self.initialize_mdp_data()
         
@@ -47,7 +83,7 @@ class AIAgent:
         self.dino = dino
         
         # current state and action
-        self.state = dino.get_state()
+        self.state = dino.get_state() if dino else None
         self.action = 0
 
     def get_reward(self, isCrashed, obsPassed=False):
@@ -73,6 +109,21 @@ class AIAgent:
         
         return reward
         
+    def get_rewards(self, isCrashed, obsPassed):
+        """Vectorized reward function.
+        
+        Args:
+            'isCrashed' (np.array of bool): whether the Game has been failed at each state
+            'obsPassed' (np.array of bool): whether an obstacle has been passed at each state
+            
+        Return:
+            'rewards' (np.array of float): reward earned in each state
+        """
+        # evaluate the reward function on all the possible cases
+        reward_table = np.array([[self.get_reward(crashed, passed) for passed in (False, True)] for crashed in (False, True)], dtype=float)
+        
+        return reward_table[np.asarray(isCrashed, dtype=int), np.asarray(obsPassed, dtype=int)]
+        
     def reset(self):
         """Reset the simulation parameters.
         
@@ -83,9 +134,15 @@ class AIAgent:
         """    
         # record the last transition information
         self.set_transition() 
+        self.flush_episode()
+        if self.transition_logger:
+            self.transition_logger.flush()
         
         # update the approximate MDP with the simulation observations
-        self.update_mdp_parameters()
+        if self.async_solve:
+            self.start_mdp_update()
+        else:
+            self.update_mdp_parameters()
         
         # make the algorithm more greedy
         self.eps += 0.01
@@ -99,6 +156,8 @@ class AIAgent:
     def choose_action(self):
         """Choose the next action with an Epsilon-Greedy exploration strategy.
         """               
+        self.n_steps += 1
+        
         # epsilon-greedy strategy
         if np.random.rand() < self.eps: 
             # choose greedily the best action
@@ -127,18 +186,55 @@ class AIAgent:
         # get the index of the closest discretized state
         s = self.get_closest_state_idx(state)
         
-        # value function if taking each action in the current state 
-        score_nothing = self.mdp_data['transition_probs'][s, 0, :].dot(self.mdp_data['value'])
-        score_jump = self.mdp_data['transition_probs'][s, 1, :].dot(self.mdp_data['value'])
-        
-        # DUCK ACTION NOT USED: CAN BEAT GAME WITHOUT DUCKING
-        #score_duck = self.mdp_data['transition_probs'][s, 2, :].dot(self.mdp_data['value']) 
-
         # best action in the current state
-        action = (score_jump > score_nothing)*1
+        action = self.get_policy()[s]
         
         return action
         
+    def get_policy(self):
+        """Get the greedy policy of the current approximate MDP.
+        The policy is cached until the next update of the MDP.
+        
+        Return:
+            'policy' (list of int, [num_states]): optimal action in each discretized state
+        """
+        # swap in the result of the background solve
+        if self.solution is not None:
+            self.apply_solution()
+        
+        if self.policy is None:
+            self.update_policy()
+        
+        return self.policy
+        
+    def update_policy(self):
+        """Compute the greedy policy and the Q-values of the current approximate MDP.
+        """
+        # value function if taking each action in each state
+        self.q_values = self.mdp_data['transition_counts'].expected_values(self.mdp_data['value'])
+        
+        # best action in each state
+        self.policy = self.greedy_policy(self.q_values)
+        
+    def greedy_policy(self, q_values):
+        """Get the greedy policy of given Q-values.
+        
+        Args:
+            'q_values' (np.array, [num_states, 2]): expected next state value of each (state, action) pair
+            
+        Return:
+            'policy' (list of int, [num_states]): best action in each discretized state
+        """
+        # DUCK ACTION NOT USED: CAN BEAT GAME WITHOUT DUCKING
+        
+        return (q_values[:, 1] > q_values[:, 0]).astype(int).tolist()
+        
+    def invalidate_policy(self):
+        """Invalidate the cached greedy policy after a change of the approximate MDP.
+        """
+        self.policy = None
+        self.q_values = None
+        
     def get_closest_state_idx(self, state, isFail=False):
         """Get the index of the closest discretized state.
         
@@ -153,22 +249,19 @@ class AIAgent:
             The state of the Dino is defined by: the time to the next obstacle (dt), the height of the dino (y), and if the obstacle is a Pterodactyl, its flight level.
             State 0 is a FAIL state ; State 1 is a NO_OBSTACLE state.
         """
-        # discretized state
-        dt_s, dy_s, dy_pter_s = self.mdp_data["state_discretization"]
-                
-        if not state: # no obstacle created yet
-            return 1
+        return self.binning.index(state, isFail)
         
-        if state['type'] == "PTERODACTYL":
-            i = np.argmin(abs(dy_pter_s - state['config']))
-        else:
-            i = dy_pter_s.size
+    def get_closest_state_indices(self, states, isFail=None):
+        """Vectorized version of 'get_closest_state_idx'.
         
-        # closest discretized state indices
-        j = np.argmin(abs(dt_s - state['dt']))
-        k = np.argmin(abs(dy_s - state['y']))
-        
-        return (not isFail)*(i*dt_s.size*dy_s.size + j*dy_s.size + k + 2)
+        Args:
+            'states' (dict of np.array): states of the Dino, with the obstacle 'type' given by its code in OBSTACLE_TYPES (-1 if no obstacle)
+            'isFail' (np.array of bool, default=None): whether the Game is failed in each state
+            
+        Return:
+            'ind' (np.array of int): indices of the closest discretized states
+        """
+        return self.binning.indices(states, isFail)
         
     def initialize_mdp_data(self):
         """Save a attributes 'mdp_data' that contains all the parameters defining the approximate MDP.
@@ -181,6 +274,9 @@ class AIAgent:
             - Value function array initialized to 0
             - Transition probability initialized uniformly: p(x'|x,a) = 1/num_states 
             - State rewards initialized to 0
+            
+        Remarks:
+            The transition counts are stored sparsely, the transition probabilities are normalized lazily from them.
         """
         
         num_states = (1 + 1*len(PTERODACTYL_HEIGHTS) )*self.args.n_t*self.args.n_y + 2
@@ -191,8 +287,7 @@ class AIAgent:
         dy_pter_s = np.array(PTERODACTYL_HEIGHTS).astype(float)
 
         # mdp parameters initialization
-        transition_counts = np.zeros((num_states, 2, num_states))
-        transition_probs = np.ones((num_states, 2, num_states)) / num_states
+        transition_counts = SparseTransitions(num_states, 2)
         reward_counts = np.zeros((num_states, 2))
         reward = np.zeros(num_states)
         value = np.zeros(num_states)
@@ -201,29 +296,66 @@ class AIAgent:
             'num_states': num_states,
             'state_discretization': [dt_s, dy_s, dy_pter_s],
             'transition_counts': transition_counts,
-            'transition_probs': transition_probs,
             'reward_counts': reward_counts,
             'reward': reward,
             'value': value
         }
         
+        # arithmetic mapping from the states to the discretized states
+        self.binning = StateBinning(dt_s, dy_s, dy_pter_s)
+        
+    def set_mdp_data(self, mdp_data):
+        """Replace the approximate MDP parameters, for instance with loaded ones.
+        
+        Args:
+            'mdp_data' (dict): parameters of the approximate MDP, see 'initialize_mdp_data'
+        """
+        self.mdp_data = mdp_data
+        self.binning = StateBinning(*mdp_data['state_discretization'])
+        self.invalidate_policy()
+        
     def set_transition(self):
-        """Update the approximate MDP with the given transition.
+        """Buffer the given transition: it is recorded in the approximate MDP at the end of the simulation, see 'flush_episode'.
         """
         # whether the Game has been failed at the new state
         isCrashed = self.dino.is_crashed()
         # get the new state
         new_state = self.dino.get_state()
         # whether an obstacle has been passed
-        obsPassed = new_state['dx'] > self.state['dx']
+        obsPassed = bool(self.state and new_state) and new_state['dx'] > self.state['dx']
         # get the previous state reward
         reward = self.get_reward(isCrashed, obsPassed)
-        # store the given transition
-        self.update_mdp_counts(self.state, self.action, new_state, reward, isCrashed)
+        # buffer the given transition
+        self.episode[self.n_episode] = (self.state, self.action, new_state, reward, isCrashed)
+        self.n_episode += 1
+        if self.n_episode == len(self.episode):
+            self.flush_episode()
         
         # update the current state
         self.state = new_state
         
+    def flush_episode(self):
+        """Record the buffered transitions in the approximate MDP, and in the transition log.
+        
+        Remarks:
+            The transitions are encoded, discretized and counted in bulk, see 'update_mdp_counts_batch'.
+        """
+        if not self.n_episode:
+            return
+        
+        states, actions, new_states, rewards, crashes = zip(*self.episode[:self.n_episode])
+        records = np.zeros(self.n_episode, dtype=RECORD_DTYPE)
+        encode_states(records['state'], states)
+        records['action'] = actions
+        encode_states(records['new_state'], new_states)
+        records['reward'] = rewards
+        records['crashed'] = crashes
+        
+        self.update_mdp_counts_batch(records['state'], records['action'], records['new_state'], records['crashed'])
+        if self.transition_logger:
+            self.transition_logger.log_many(records)
+        self.n_episode = 0
+        
     def update_mdp_counts(self, state, action, new_state, reward, isCrashed):
         """Update the transition counts and reward counts based on the given transition.
         
@@ -242,42 +374,123 @@ class AIAgent:
         new_s = self.get_closest_state_idx(new_state, isCrashed)
                 
         # update the transition and the reward counts
-        self.mdp_data['transition_counts'][s, action, new_s] += 1
+        self.mdp_data['transition_counts'].add(s, action, new_s)
         self.mdp_data['reward_counts'][new_s, 0] += reward
         self.mdp_data['reward_counts'][new_s, 1] += 1
 
+    def update_mdp_counts_batch(self, states, actions, new_states, isCrashed):
+        """Vectorized version of 'update_mdp_counts' on a batch of transitions.
+        
+        Args:
+            'states' (dict of np.array): previous states of the Dino, see 'get_closest_state_indices'
+            'actions' (np.array of int): last actions performed
+            'new_states' (dict of np.array): new states after performing the actions in the previous states
+            'isCrashed' (np.array of bool): whether the Game has been failed in each new state
+        """
+        # get the index of the closest discretized previous and new states
+        s = self.get_closest_state_indices(states)
+        new_s = self.get_closest_state_indices(new_states, isCrashed)
+        
+        # rewards observed in the new states (an obstacle can only be passed if both states have one)
+        hasObstacles = (np.asarray(states['type']) >= 0) & (np.asarray(new_states['type']) >= 0)
+        obsPassed = hasObstacles & (np.asarray(new_states['dx']) > np.asarray(states['dx']))
+        rewards = self.get_rewards(isCrashed, obsPassed)
+        
+        # update the transition and the reward counts
+        num_states = self.mdp_data['num_states']
+        self.mdp_data['transition_counts'].add_many(s, actions, new_s)
+        self.mdp_data['reward_counts'][:, 0] += np.bincount(new_s, weights=rewards, minlength=num_states)
+        self.mdp_data['reward_counts'][:, 1] += np.bincount(new_s, minlength=num_states)
+
     def update_mdp_parameters(self):
         """Update the estimated MDP parameters (transition and reward functions) at the end of a simulation.
-        Perform value iteration using the new estimated model for the MDP.
+        Solve for the value function using the new estimated model for the MDP.
 
         Remarks:
             Only observed transitions are updated.
             Only states with observed rewards are updated.
+            Incremental solvers only propagate the changes of the states observed during the simulation.
+        """
+        # update the transition and reward functions
+        changed_states = self.update_mdp_estimates()
+
+        # update the value function
+        self.mdp_data['value'], self.solve_stats = solve(self.solver, self.mdp_data['transition_counts'], self.mdp_data['reward'], self.mdp_data['value'],
+                                                         self.gamma, self.tolerance, changed_states)
+        
+        # refresh the greedy policy
+        self.update_policy()
+        
+    def update_mdp_estimates(self):
+        """Update the estimated transition and reward functions with the recorded counts.
+        
+        Return:
+            'changed_states' (np.array of int): states whose transitions or reward changed
         """
-        temp = self.mdp_data['transition_probs'].copy()
         # update the transition function
-        total_num_transitions = np.sum(self.mdp_data['transition_counts'], axis=-1)
-        visited_state_action_pairs = total_num_transitions > 0
-        self.mdp_data['transition_probs'][visited_state_action_pairs] = self.mdp_data['transition_counts'][visited_state_action_pairs] / total_num_transitions[visited_state_action_pairs, np.newaxis]
+        transitions = self.mdp_data['transition_counts']
+        changed_rows = transitions.compact()
 
         # update the reward function
+        previous_reward = self.mdp_data['reward'].copy()
         visited_states = self.mdp_data['reward_counts'][:, 1] > 0
         self.mdp_data['reward'][visited_states] = self.mdp_data['reward_counts'][visited_states, 0] / self.mdp_data['reward_counts'][visited_states, 1]
 
-        # update the value function through Value Iteration
-        while True:           
-            # Q(_,a) for the different actions
-            value_nojump = np.dot(self.mdp_data['transition_probs'][:,0,:], self.mdp_data['value'])
-            value_jump = np.dot(self.mdp_data['transition_probs'][:,1,:], self.mdp_data['value'])
-
-            # Bellman update
-            new_value = self.mdp_data['reward'] + self.gamma * np.maximum(value_nojump, value_jump)
-            
-            # difference with previous value function
-            max_diff = np.max(np.abs(new_value - self.mdp_data['value']))
-
-            self.mdp_data['value'] = new_value
-            
-            # check for convergence
-            if max_diff < self.tolerance:
-                break
+        return np.union1d(changed_rows // transitions.num_actions, np.flatnonzero(self.mdp_data['reward'] != previous_reward))
+        
+    def start_mdp_update(self):
+        """Update the estimated MDP parameters, and solve for the value function on a background thread.
+        The current policy is used until the new one is swapped in by 'get_policy'.
+        
+        Remarks:
+            At most one solve runs at a time: the previous one is waited for, so the policy is at most one simulation late.
+            The solve works on a snapshot: the compacted transition arrays are shared (they are replaced, never modified, by 'compact'), the reward and the value are copied.
+        """
+        self.wait_mdp_update()
+        
+        # update the transition and reward functions
+        changed_states = self.update_mdp_estimates()
+        
+        transitions = self.mdp_data['transition_counts']
+        snapshot = SparseTransitions.from_arrays(transitions.num_states, transitions.num_actions,
+                                                 transitions.rows, transitions.cols, transitions.counts, transitions.indptr)
+        self.solve_thread = threading.Thread(target=self.solve_in_background, daemon=True,
+                                             args=(snapshot, self.mdp_data['reward'].copy(), self.mdp_data['value'].copy(), changed_states,
+                                                   time.time(), self.n_steps))
+        self.solve_thread.start()
+        
+    def solve_in_background(self, transitions, reward, value, changed_states, start_time, start_step):
+        """Solve for the value function and the greedy policy of a snapshot of the approximate MDP (run on the background thread).
+        
+        Args:
+            'transitions' (SparseTransitions), 'reward' (np.array), 'value' (np.array): snapshot of the approximate MDP
+            'changed_states' (np.array of int): states whose transitions or reward changed
+            'start_time' (float): time at which the solve was started
+            'start_step' (int): number of steps taken when the solve was started
+        """
+        value, solve_stats = solve(self.solver, transitions, reward, value, self.gamma, self.tolerance, changed_states)
+        q_values = transitions.expected_values(value)
+        policy = self.greedy_policy(q_values)
+        
+        solve_stats['start_time'], solve_stats['start_step'] = start_time, start_step
+        # single assignment: the main thread sees either no solution or a complete one
+        self.solution = (value, q_values, policy, solve_stats)
+        
+    def apply_solution(self):
+        """Swap in the value function and the policy computed by the background solve.
+        """
+        solution, self.solution = self.solution, None
+        self.mdp_data['value'], self.q_values, self.policy, self.solve_stats = solution
+        
+        # how stale the replaced policy was
+        self.solve_stats['stale_steps'] = self.n_steps - self.solve_stats.pop('start_step')
+        self.solve_stats['stale_time'] = time.time() - self.solve_stats.pop('start_time')
+        
+    def wait_mdp_update(self):
+        """Wait for the background solve to finish and swap in its result.
+        """
+        if self.solve_thread is not None:
+            self.solve_thread.join()
+            self.solve_thread = None
+        if self.solution is not None:
+            self.apply_solution()
@@ -18,6 +18,8 @@ def get_game_args():
     add_sim_args(parser)
     # add arguments relative to the RL algorithm     
     add_RL_args(parser)
+    # add arguments relative to the latency instrumentation
+    add_profile_args(parser)
     
     parser.add_argument('--commands_filename',
                         type=str,
@@ -30,8 +32,8 @@ def get_game_args():
     parser.add_argument('--agent',
                         type=str,
                         default="ai",
-                        choices=("human", "ai"),
-                        help="Whether to use a human or an AI agent.")
+                        choices=("human", "ai", "tile", "adaptive", "q"),
+                        help="Whether to use a human, an AI agent solving a discretized MDP (uniform grid or adaptive partition), or an AI agent learning a tile-coded or a tabular action-value function.")
                         
     args = parser.parse_args()
 
@@ -39,6 +41,11 @@ def get_game_args():
 
 def add_env_args(parser):
     """Add arguments needed to interact with the JavaScript game."""
+    parser.add_argument('--env',
+                        type=str,
+                        default="chrome",
+                        choices=("chrome", "sim"),
+                        help="Whether to play the Chrome game or the headless simulator.")
     parser.add_argument('--game_url',
                         type=str,
                         default='chrome://dino',
@@ -47,6 +54,10 @@ def add_env_args(parser):
                         type=str,
                         default='./chromedriver.exe',
                         help="Path to the Chrome driver for Selenium.")
+    parser.add_argument('--frame_step',
+                        type=bool,
+                        default=False,
+                        help="Whether to stop the animation loop of the game and step it frame by frame from Python.")
     parser.add_argument('--dino_sprite_1x',
                         type=str,
                         default='',
@@ -80,6 +91,10 @@ def add_sim_args(parser):
                         type=bool,
                         default=True,
                         help="Whether to let the AI train in the background.")
+    parser.add_argument('--seed',
+                        type=int,
+                        default=None,
+                        help="Seed of the obstacle sequences: each simulation of a given number plays the same obstacles. Random if not given.")
                         
 
 def add_RL_args(parser):
@@ -88,6 +103,10 @@ def add_RL_args(parser):
                         type=float,
                         default=0.01, 
                         help="Time discretization between two successive actions (in s).")
+    parser.add_argument('--adaptive_dt',
+                        type=bool,
+                        default=False,
+                        help="Whether to lengthen the time step to the measured p95 latency of the control loop, in the real-time Chrome game.")
     parser.add_argument('--n_t',
                         type=int,
                         default=10, #20,
@@ -116,12 +135,76 @@ def add_RL_args(parser):
                         type=float,
                         default=0.01,
                         help="Convergence criterium for Value Iteration.")
+    parser.add_argument('--alpha',
+                        type=float,
+                        default=0.1,
+                        help="Learning rate of the tile-coding agent.")
+    parser.add_argument('--n_tilings',
+                        type=int,
+                        default=8,
+                        help="Number of tilings of the tile-coding agent.")
+    parser.add_argument('--n_tiles',
+                        type=int,
+                        default=16,
+                        help="Number of tiles of a tiling along dt and along y, for the tile-coding agent.")
+    parser.add_argument('--split_samples',
+                        type=int,
+                        default=64,
+                        help="Minimum number of samples of a cell before it can split, for the adaptive partition.")
+    parser.add_argument('--initial_depth',
+                        type=int,
+                        default=4,
+                        help="Depth of the initial trees of the adaptive partition: each obstacle level starts as a grid of 2^initial_depth cells.")
+    parser.add_argument('--max_depth',
+                        type=int,
+                        default=10,
+                        help="Maximum depth of the trees of the adaptive partition.")
+    parser.add_argument('--solver',
+                        type=str,
+                        default="value_iteration",
+                        choices=("value_iteration", "gauss_seidel", "policy_iteration", "modified_policy_iteration", "prioritized_sweeping"),
+                        help="Algorithm solving the approximate MDP after each simulation.")
+    parser.add_argument('--async_solve',
+                        type=bool,
+                        default=False,
+                        help="Whether to solve the MDP in the background while the next simulation is played.")
+    parser.add_argument('--n_workers',
+                        type=int,
+                        default=4,
+                        help="Number of games played in parallel by 'parallel.py'.")
     parser.add_argument('--save_filename',
                         type=str,
-                        default='ai_save.json',
-                        help="Name of the JSON file saving the agent parameters.")
+                        default='ai_save',
+                        help="Name of the checkpoint directory saving the agent parameters (JSON files from older versions can be loaded).")
     parser.add_argument('--load_save',
                         type=bool,
                         default=False,
                         help="Whether to load the agent parameters from the saved file.")
-     
\ No newline at end of file
+    parser.add_argument('--transition_log',
+                        type=str,
+                        default=None,
+                        help="Name of the binary file where the observed transitions are appended (no log if None).")
+    parser.add_argument('--autosave_every',
+                        type=int,
+                        default=0,
+                        help="Save the agent parameters in the background every N simulations (0 to disable).")
+     
+
+def add_profile_args(parser):
+    """Add arguments relative to the latency instrumentation."""
+    parser.add_argument('--profile',
+                        type=bool,
+                        default=False,
+                        help="Whether to time the calls of the game, the Dino and the agent.")
+    parser.add_argument('--trace_filename',
+                        type=str,
+                        default="trace.json",
+                        help="Name of the Chrome trace-event JSON file of the traced steps.")
+    parser.add_argument('--trace_start',
+                        type=int,
+                        default=0,
+                        help="First traced time step.")
+    parser.add_argument('--trace_steps',
+                        type=int,
+                        default=0,
+                        help="Number of traced time steps (0 to disable the trace).")
@@ -0,0 +1,441 @@
+"""Vectorized headless simulation of N Dino games in lockstep.
+
+Authors:
+    Gael Colas
+
+Remarks:
+    Same physics as 'sim.SimGame', with the state of all the games stored in NumPy arrays.
+"""
+
+import time
+
+import numpy as np
+
+from args import get_game_args
+from agent import AIAgent
+from sim import (FPS, MS_PER_FRAME, WIDTH, GAP_COEFFICIENT, MAX_GAP_COEFFICIENT, MAX_OBSTACLE_LENGTH,
+                 DISTANCE_COEFFICIENT, TREX_CONFIG, TREX_GROUND_Y_POS, TREX_MIN_JUMP_Y_POS,
+                 TREX_COLLISION_BOXES, OBSTACLE_CONFIGS)
+
+# maximum number of obstacles on the canvas at the same time
+MAX_OBSTACLES = 4
+
+# obstacle type parameters, indexed by obstacle type code (same codes as 'agent.OBSTACLE_TYPES')
+OBS_WIDTH = np.array([c['width'] for c in OBSTACLE_CONFIGS], dtype=float)
+OBS_HEIGHT = np.array([c['height'] for c in OBSTACLE_CONFIGS], dtype=float)
+OBS_MULTIPLE_SPEED = np.array([c['multipleSpeed'] for c in OBSTACLE_CONFIGS], dtype=float)
+OBS_MIN_GAP = np.array([c['minGap'] for c in OBSTACLE_CONFIGS], dtype=float)
+OBS_MIN_SPEED = np.array([c['minSpeed'] for c in OBSTACLE_CONFIGS], dtype=float)
+OBS_SPEED_OFFSET = np.array([c['speedOffset'] for c in OBSTACLE_CONFIGS], dtype=float)
+OBS_Y_POS = [np.array(c['yPos'], dtype=float) for c in OBSTACLE_CONFIGS]
+
+# obstacle collision boxes padded to the same number of boxes (shape: n_types x n_boxes x 4)
+N_OBS_BOXES = max(len(c['collisionBoxes']) for c in OBSTACLE_CONFIGS)
+OBS_BOXES = np.zeros((len(OBSTACLE_CONFIGS), N_OBS_BOXES, 4))
+OBS_BOXES_MASK = np.zeros((len(OBSTACLE_CONFIGS), N_OBS_BOXES), dtype=bool)
+for obs_type, obs_config in enumerate(OBSTACLE_CONFIGS):
+    n_boxes = len(obs_config['collisionBoxes'])
+    OBS_BOXES[obs_type, :n_boxes] = obs_config['collisionBoxes']
+    OBS_BOXES_MASK[obs_type, :n_boxes] = True
+
+# dino collision boxes padded to the same number of boxes (shape: 2 x n_boxes x 4), index 1 for ducking
+N_TREX_BOXES = len(TREX_COLLISION_BOXES['RUNNING'])
+TREX_BOXES = np.zeros((2, N_TREX_BOXES, 4))
+TREX_BOXES[0] = TREX_COLLISION_BOXES['RUNNING']
+TREX_BOXES[1, :1] = TREX_COLLISION_BOXES['DUCKING']
+TREX_BOXES_MASK = np.zeros((2, N_TREX_BOXES), dtype=bool)
+TREX_BOXES_MASK[0] = True
+TREX_BOXES_MASK[1, :1] = True
+
+
+def boxes_compare(box_a, box_b):
+    """Vectorized version of 'sim.box_compare' on arrays of boxes (..., 4).
+    """
+    return ((box_a[..., 0] < box_b[..., 0] + box_b[..., 2]) & (box_a[..., 0] + box_a[..., 2] > box_b[..., 0]) &
+            (box_a[..., 1] < box_b[..., 1] + box_b[..., 3]) & (box_a[..., 1] + box_a[..., 3] > box_b[..., 1]))
+
+
+class BatchEnv:
+    """'BatchEnv' class: N headless Dino games stepped in lockstep.
+
+    Attributes:
+        'n_games' (int): number of games N
+        'frames_per_step' (int): number of frames simulated per control step
+        'config' (dict): simulation parameters of the Runner (SPEED, MAX_SPEED, ACCELERATION, CLEAR_TIME)
+        'seed' (int): seed of the random generators, None for random obstacle courses
+        'game_rngs' (list of np.random.RandomState): random generator of the obstacles of each game, reseeded with 'seed', the game and the number of the simulation at each restart, like 'SimGame.seeded_rng' ; None without seed: the obstacles are drawn from 'np.random'
+        'explore_rng' (np.random.RandomState): random generator of the exploration of the agent, separate from the obstacles
+
+        'speed', 'running_time', 'distance' (np.array, [N]): Runner state of each game
+        'y', 'jump_velocity', 'jumping', 'ducking', 'speed_drop', 'reached_min_height' (np.array, [N]): dino state of each game
+        'obs_*' (np.array, [N, MAX_OBSTACLES]): obstacle queue of each game, 'obs_type' is -1 for empty slots
+        'history' (np.array, [N, 2]): types of the last generated obstacles of each game
+        'n_sim' (np.array, [N]): number of simulations played by each game
+    """
+    def __init__(self, args, n_games):
+        self.n_games = n_games
+        self.frames_per_step = max(1, int(round(args.dt * FPS)))
+        self.config = {
+            'SPEED': args.initial_speed,
+            'MAX_SPEED': args.max_speed,
+            'ACCELERATION': args.acceleration,
+            'CLEAR_TIME': args.clear_time
+        }
+        self.seed = args.seed
+        self.game_rngs = None if args.seed is None else [np.random.RandomState() for _ in range(n_games)]
+        self.explore_rng = np.random.RandomState(args.seed)
+
+        # Runner state
+        self.speed = np.zeros(n_games)
+        self.running_time = np.zeros(n_games)
+        self.distance = np.zeros(n_games)
+        self.n_sim = np.zeros(n_games, dtype=int)
+
+        # Trex state
+        self.y = np.zeros(n_games)
+        self.jump_velocity = np.zeros(n_games)
+        self.jumping = np.zeros(n_games, dtype=bool)
+        self.ducking = np.zeros(n_games, dtype=bool)
+        self.speed_drop = np.zeros(n_games, dtype=bool)
+        self.reached_min_height = np.zeros(n_games, dtype=bool)
+
+        # obstacle queues
+        shape = (n_games, MAX_OBSTACLES)
+        self.obs_type = np.full(shape, -1, dtype=int)
+        self.obs_size = np.zeros(shape, dtype=int)
+        self.obs_x = np.zeros(shape)
+        self.obs_y = np.zeros(shape)
+        self.obs_width = np.zeros(shape)
+        self.obs_gap = np.zeros(shape)
+        self.obs_speed_offset = np.zeros(shape)
+        self.obs_following = np.zeros(shape, dtype=bool)
+        self.history = np.full((n_games, 2), -1, dtype=int)
+
+        self.reset(np.ones(n_games, dtype=bool))
+
+    def reset(self, games):
+        """Restart the selected games.
+
+        Args:
+            'games' (np.array of bool, [N]): mask of the games to restart
+        """
+        self.speed[games] = self.config['SPEED']
+        self.running_time[games] = 0.
+        self.distance[games] = 0.
+        self.n_sim[games] += 1
+        if self.seed is not None:
+            for game in np.flatnonzero(games):
+                self.game_rngs[game].seed([self.seed, game, self.n_sim[game]])
+
+        self.y[games] = TREX_GROUND_Y_POS
+        self.jump_velocity[games] = 0.
+        self.jumping[games] = False
+        self.ducking[games] = False
+        self.speed_drop[games] = False
+        self.reached_min_height[games] = False
+
+        self.obs_type[games] = -1
+        self.obs_following[games] = False
+        self.history[games] = -1
+
+    def get_score(self):
+        """Get the current score of each game.
+
+        Return:
+            'score' (np.array of int, [N]): current scores
+        """
+        return np.round(self.distance * DISTANCE_COEFFICIENT).astype(int)
+
+    def get_state(self):
+        """Get the state of the Dino in each game.
+
+        Return:
+            'states' (dict of np.array, [N]): same fields as 'Dino.get_state': 'dx', 'dt', 'y', 'speed', 'type', 'config'
+
+        Remarks:
+            'type' is the obstacle type code of 'agent.OBSTACLE_TYPES', -1 if no obstacle has been generated yet.
+        """
+        rows = np.arange(self.n_games)
+
+        # check if the first obstacle has been passed
+        next_idx = ((self.obs_type[:, 1] >= 0) & (self.obs_x[:, 0] < TREX_CONFIG['START_X_POS'])).astype(int)
+
+        obs_type = self.obs_type[rows, next_idx]
+        dx = self.obs_x[rows, next_idx]
+        config = np.where(obs_type == 2, self.obs_y[rows, next_idx], self.obs_size[rows, next_idx])
+
+        states = {
+            'dx': dx,
+            'dt': dx / (100*self.speed),
+            'y': self.y.copy(),
+            'speed': self.speed.copy(),
+            'type': obs_type,
+            'config': config
+        }
+        return states
+
+    def step(self, actions):
+        """Advance all the games by one control step.
+
+        Args:
+            'actions' (np.array of int, [N]): action of each game: 1 if 'jumping', 2 if 'ducking', 0 otherwise
+
+        Return:
+            'new_states' (dict of np.array, [N]): state reached by each game at the end of the step (before restarting), see 'get_state'
+            'crashed' (np.array of bool, [N]): whether each game has crashed during the step
+            'scores' (np.array of int, [N]): score of each game at the end of the step (before restarting)
+            'next_states' (dict of np.array, [N]): state of each game at the start of the next step
+
+        Remarks:
+            Crashed games are restarted: their next state is the first state of the next simulation.
+            The transitions end in 'new_states': the crashes are recorded in the FAIL state.
+        """
+        # jump
+        start_jump = (actions == 1) & ~self.jumping & ~self.ducking
+        self.jump_velocity[start_jump] = TREX_CONFIG['INITIAL_JUMP_VELOCITY'] - self.speed[start_jump] / 10
+        self.jumping[start_jump] = True
+        self.reached_min_height[start_jump] = False
+        self.speed_drop[start_jump] = False
+
+        # speed drop if jumping, otherwise duck for the whole step
+        duck = actions == 2
+        speed_drop = duck & self.jumping
+        self.speed_drop[speed_drop] = True
+        self.jump_velocity[speed_drop] = 1
+        self.ducking[duck & ~self.jumping] = True
+
+        crashed = np.zeros(self.n_games, dtype=bool)
+        for _ in range(self.frames_per_step):
+            crashed |= self._update(~crashed)
+
+        # release the duck key
+        self.ducking[:] = False
+
+        new_states = self.get_state()
+        scores = self.get_score()
+        if not crashed.any():
+            return new_states, crashed, scores, new_states
+
+        self.reset(crashed)
+
+        return new_states, crashed, scores, self.get_state()
+
+    def _update(self, playing):
+        """Advance the playing games by one frame.
+
+        Args:
+            'playing' (np.array of bool, [N]): mask of the games to update
+
+        Return:
+            'crashed' (np.array of bool, [N]): whether each game has crashed during the frame
+        """
+        # jump
+        jumping = playing & self.jumping
+        velocity = self.jump_velocity[jumping]
+        drop = self.speed_drop[jumping]
+        self.y[jumping] += np.round(velocity * np.where(drop, TREX_CONFIG['SPEED_DROP_COEFFICIENT'], 1))
+        self.jump_velocity[jumping] = velocity + TREX_CONFIG['GRAVITY']
+
+        y = self.y[jumping]
+        reached = self.reached_min_height[jumping] | (y < TREX_MIN_JUMP_Y_POS) | drop
+        self.reached_min_height[jumping] = reached
+        end_jump = ((y < TREX_CONFIG['MAX_JUMP_HEIGHT']) | drop) & reached & (self.jump_velocity[jumping] < TREX_CONFIG['DROP_VELOCITY'])
+        self.jump_velocity[np.flatnonzero(jumping)[end_jump]] = TREX_CONFIG['DROP_VELOCITY']
+
+        landed = np.zeros(self.n_games, dtype=bool)
+        landed[jumping] = y > TREX_GROUND_Y_POS
+        self.y[landed] = TREX_GROUND_Y_POS
+        self.jump_velocity[landed] = 0.
+        self.jumping[landed] = False
+        self.speed_drop[landed] = False
+
+        # move the obstacles
+        self.running_time[playing] += MS_PER_FRAME
+        has_obstacles = playing & (self.running_time > self.config['CLEAR_TIME'])
+        valid = has_obstacles[:, np.newaxis] & (self.obs_type >= 0)
+        obs_speed = self.speed[:, np.newaxis] + self.obs_speed_offset
+        self.obs_x -= valid * np.floor(obs_speed * FPS / 1000 * MS_PER_FRAME)
+
+        # remove the first obstacle when it leaves the canvas
+        removed = valid[:, 0] & (self.obs_x[:, 0] + self.obs_width[:, 0] <= 0)
+        if removed.any():
+            for obs_array in (self.obs_type, self.obs_size, self.obs_x, self.obs_y, self.obs_width,
+                              self.obs_gap, self.obs_speed_offset, self.obs_following):
+                obs_array[removed, :-1] = obs_array[removed, 1:]
+            self.obs_type[removed, -1] = -1
+
+        # generate new obstacles
+        self._add_new_obstacles(has_obstacles)
+
+        # check for collisions with the first obstacle
+        crashed = has_obstacles & (self.obs_type[:, 0] >= 0)
+        crashed[crashed] = self._check_for_collision(np.flatnonzero(crashed))
+
+        # update the distance and the speed
+        running = playing & ~crashed
+        self.distance[running] += self.speed[running]
+        accelerate = running & (self.speed < self.config['MAX_SPEED'])
+        self.speed[accelerate] += self.config['ACCELERATION']
+
+        return crashed
+
+    def _add_new_obstacles(self, has_obstacles):
+        """Generate new obstacles in the games that need one (Horizon.updateObstacles).
+        """
+        rows = np.arange(self.n_games)
+        n_obstacles = np.sum(self.obs_type >= 0, axis=1)
+        last = np.maximum(n_obstacles - 1, 0)
+
+        last_x = self.obs_x[rows, last]
+        last_width = self.obs_width[rows, last]
+        needs_following = (~self.obs_following[rows, last] & (last_x + last_width > 0) &
+                           (last_x + last_width + self.obs_gap[rows, last] < WIDTH))
+        new = has_obstacles & (n_obstacles < MAX_OBSTACLES) & ((n_obstacles == 0) | needs_following)
+        if not new.any():
+            return
+
+        games = np.flatnonzero(new)
+        self.obs_following[games, last[games]] = n_obstacles[games] > 0
+        slots = n_obstacles[games]
+        speed = self.speed[games]
+
+        # random draws of each game from its own generator: the obstacle course of a game does not depend on the other games
+        # uniform draws (type, size, flight level, speed offset, gap) of each obstacle
+        if self.game_rngs is None:
+            draws = np.random.rand(games.size, 5)
+        else:
+            draws = np.array([self.game_rngs[game].rand(5) for game in games]).reshape(-1, 5)
+        obs_type = (draws[:, 0] * len(OBSTACLE_CONFIGS)).astype(int)
+        # draw the obstacle types again until there is no duplicate and no pterodactyl at low speed
+        while True:
+            history = self.history[games]
+            rejected = np.flatnonzero((np.sum(history == obs_type[:, np.newaxis], axis=1) >= history.shape[1]) | (speed < OBS_MIN_SPEED[obs_type]))
+            if not rejected.size:
+                break
+            if self.game_rngs is None:
+                obs_type[rejected] = np.random.randint(len(OBSTACLE_CONFIGS), size=rejected.size)
+            else:
+                obs_type[rejected] = [self.game_rngs[game].randint(len(OBSTACLE_CONFIGS)) for game in games[rejected]]
+
+        # multiple obstacles only allowed above a given speed
+        size = 1 + (draws[:, 1] * MAX_OBSTACLE_LENGTH).astype(int)
+        size[OBS_MULTIPLE_SPEED[obs_type] > speed] = 1
+        width = OBS_WIDTH[obs_type] * size
+
+        # flight level
+        obs_y = np.array([OBS_Y_POS[t][0] for t in range(len(OBSTACLE_CONFIGS))])[obs_type]
+        pter = obs_type == 2
+        obs_y[pter] = OBS_Y_POS[2][(draws[pter, 2] * OBS_Y_POS[2].size).astype(int)]
+
+        # pterodactyls fly faster or slower than the ground
+        speed_offset = OBS_SPEED_OFFSET[obs_type] * np.where(draws[:, 3] > 0.5, 1, -1)
+
+        # gap before the next obstacle
+        min_gap = np.round(width * speed + OBS_MIN_GAP[obs_type] * GAP_COEFFICIENT)
+        max_gap = np.round(min_gap * MAX_GAP_COEFFICIENT)
+        gap = np.floor(draws[:, 4] * (max_gap - min_gap + 1)) + min_gap
+
+        self.obs_type[games, slots] = obs_type
+        self.obs_size[games, slots] = size
+        self.obs_width[games, slots] = width
+        self.obs_x[games, slots] = WIDTH - width
+        self.obs_y[games, slots] = obs_y
+        self.obs_gap[games, slots] = gap
+        self.obs_speed_offset[games, slots] = speed_offset
+        self.obs_following[games, slots] = False
+
+        self.history[games, 1] = self.history[games, 0]
+        self.history[games, 0] = obs_type
+
+    def _check_for_collision(self, games):
+        """Check if the dino collides with the first obstacle in the selected games (checkForCollision).
+
+        Args:
+            'games' (np.array of int): indices of the games to check
+
+        Return:
+            'crashed' (np.array of bool): whether the dino collides in each of the selected games
+        """
+        obs_type = self.obs_type[games, 0]
+        obs_width = self.obs_width[games, 0]
+
+        trex_box = np.stack([np.full(games.size, TREX_CONFIG['START_X_POS'] + 1.), self.y[games] + 1,
+                             np.full(games.size, TREX_CONFIG['WIDTH'] - 2.), np.full(games.size, TREX_CONFIG['HEIGHT'] - 2.)], axis=-1)
+        obstacle_box = np.stack([self.obs_x[games, 0] + 1, self.obs_y[games, 0] + 1,
+                                 obs_width - 2, OBS_HEIGHT[obs_type] - 2], axis=-1)
+
+        # simple outer bounds check
+        crashed = boxes_compare(trex_box, obstacle_box)
+        if not crashed.any():
+            return crashed
+        games, obs_type, obs_width = games[crashed], obs_type[crashed], obs_width[crashed]
+        trex_box, obstacle_box = trex_box[crashed], obstacle_box[crashed]
+
+        # obstacle collision boxes, with the middle one stretched for consecutive cactuses
+        obs_boxes = OBS_BOXES[obs_type]
+        multiple = self.obs_size[games, 0] > 1
+        obs_boxes[multiple, 1, 2] = obs_width[multiple] - obs_boxes[multiple, 0, 2] - obs_boxes[multiple, 2, 2]
+        obs_boxes[multiple, 2, 0] = obs_width[multiple] - obs_boxes[multiple, 2, 2]
+        obs_boxes[..., :2] += obstacle_box[:, np.newaxis, :2]
+
+        ducking = self.ducking[games].astype(int)
+        trex_boxes = TREX_BOXES[ducking]
+        trex_boxes[..., :2] += trex_box[:, np.newaxis, :2]
+
+        # detailed check of all the pairs of boxes
+        overlaps = boxes_compare(trex_boxes[:, :, np.newaxis, :], obs_boxes[:, np.newaxis, :, :])
+        overlaps &= TREX_BOXES_MASK[ducking][:, :, np.newaxis] & OBS_BOXES_MASK[obs_type][:, np.newaxis, :]
+        crashed[crashed] = overlaps.any(axis=(1, 2))
+
+        return crashed
+
+
+def collect_transitions(agent, env, n_steps):
+    """Play 'n_steps' control steps in all the games and feed the transitions in bulk to the agent.
+
+    Args:
+        'agent' (AIAgent): AI agent choosing the actions and recording the transitions
+        'env' (BatchEnv): batch of games
+        'n_steps' (int): number of control steps
+
+    Return:
+        'scores' (list of int): scores of the simulations finished during the collection
+    """
+    # greedy policy of the current approximate MDP
+    policy = np.array(agent.get_policy())
+
+    scores = []
+    states = env.get_state()
+    for _ in range(n_steps):
+        # epsilon-greedy strategy
+        s = agent.get_closest_state_indices(states)
+        actions = policy[s]
+        explore = env.explore_rng.rand(env.n_games) >= agent.eps
+        actions[explore] = env.explore_rng.rand(explore.sum()) < 0.5
+
+        new_states, crashed, step_scores, next_states = env.step(actions)
+        agent.update_mdp_counts_batch(states, actions, new_states, crashed)
+
+        scores.extend(step_scores[crashed])
+        states = next_states
+
+    return scores
+
+
+if __name__=='__main__':
+    # get arguments needed to play the Game
+    args = get_game_args()
+    # create a batch of games and an AI agent without Dino controller
+    env = BatchEnv(args, n_games=1024)
+    agent = AIAgent(args, None)
+
+    for n_round in range(10):
+        start_time = time.time()
+        scores = collect_transitions(agent, env, n_steps=1000)
+        collect_time = time.time() - start_time
+
+        agent.update_mdp_parameters()
+        agent.eps += 0.01
+
+        print("Round {}: {:.0f} env-steps/s, {} simulations, mean score {:.1f}, highscore {}".format(
+            n_round, env.n_games * 1000 / collect_time, len(scores), np.mean(scores) if scores else 0, max(scores, default=0)))
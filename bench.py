@@ -0,0 +1,325 @@
+"""Benchmark the hot paths of the AI agent on synthetic data.
+
+Authors:
+    Gael Colas
+
+Remarks:
+    No game is needed: the states are drawn at random and the Dino controller is faked.
+    The results are written as JSON, and can be compared with a stored baseline to flag regressions.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import ujson as json
+
+from args import add_env_args, add_sim_args, add_RL_args
+from agent import AIAgent, OBSTACLE_TYPES, PTERODACTYL_HEIGHTS
+from mdp import SparseTransitions
+from util import save_agent, load_agent
+
+# (n_t, n_y) discretizations of the solve benchmark
+SOLVE_GRIDS = [(10, 10), (20, 20), (40, 40)]
+# probability of crashing at each synthetic step
+CRASH_PROBABILITY = 0.001
+
+
+def get_bench_args():
+    """Get arguments needed to run the benchmarks."""
+
+    parser = argparse.ArgumentParser('Benchmark the hot paths of the AI agent.')
+
+    # same arguments as the Game: discretization and solver
+    add_env_args(parser)
+    add_sim_args(parser)
+    add_RL_args(parser)
+
+    parser.add_argument('--n_calls',
+                        type=int,
+                        default=100000,
+                        help="Number of calls of the per-step benchmarks.")
+    parser.add_argument('--n_transitions',
+                        type=int,
+                        default=1000000,
+                        help="Number of synthetic transitions of the solve and save benchmarks.")
+    parser.add_argument('--n_repeats',
+                        type=int,
+                        default=5,
+                        help="Number of repetitions of each benchmark: the median is reported.")
+    parser.add_argument('--output',
+                        type=str,
+                        default="bench.json",
+                        help="Name of the JSON file where the results are written.")
+    parser.add_argument('--baseline',
+                        type=str,
+                        default=None,
+                        help="Name of a JSON file of previous results to compare with.")
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.2,
+                        help="Relative slowdown above which a benchmark is flagged as a regression.")
+
+    args = parser.parse_args()
+
+    return args
+
+
+def random_states(args, n, rng):
+    """Draw random states of the Dino.
+
+    Args:
+        'args' (ArgumentParser): parser gethering all the Game parameters
+        'n' (int): number of states
+        'rng' (np.random.RandomState): random generator
+
+    Return:
+        'states' (dict of np.array): states, see 'AIAgent.get_closest_state_indices'
+    """
+    speed = rng.uniform(args.initial_speed, args.max_speed, n)
+    dt = rng.uniform(0, args.max_dt, n)
+    obs_type = rng.randint(len(OBSTACLE_TYPES), size=n)
+    config = np.where(obs_type == OBSTACLE_TYPES['PTERODACTYL'], rng.choice(PTERODACTYL_HEIGHTS, n), rng.randint(1, 4, n))
+    return {
+        'dx': dt * 100 * speed,
+        'dt': dt,
+        'y': rng.uniform(0, args.max_y, n),
+        'speed': speed,
+        'type': obs_type,
+        'config': config.astype(float)
+    }
+
+
+def state_dicts(states):
+    """Convert states given as arrays to a list of states as returned by 'Dino.get_state'.
+    """
+    type_names = {code: name for name, code in OBSTACLE_TYPES.items()}
+    keys = ('dx', 'dt', 'y', 'speed', 'config')
+    return [dict({key: float(states[key][i]) for key in keys}, type=type_names[states['type'][i]])
+            for i in range(states['type'].size)]
+
+
+class FakeDino:
+    """Dino controller replaying random states, see 'Dino'.
+
+    Attributes:
+        'states' (list of dict): states returned in turn by 'get_state'
+        'crashes' (np.array of bool): crash flag of each state
+        't' (int): index of the current state
+    """
+    def __init__(self, states, crashes):
+        self.states = states
+        self.crashes = crashes
+        self.t = 0
+
+    def get_state(self):
+        """Get the current state of the replay.
+        """
+        return self.states[self.t % len(self.states)]
+
+    def is_crashed(self):
+        """Get the crash flag of the current state.
+        """
+        return self.crashes[self.t % len(self.states)]
+
+    def act(self, action):
+        """Move to the next state of the replay, whatever the action.
+        """
+        self.t += 1
+
+    def run(self):
+        """Do nothing for one time step.
+        """
+        self.act(0)
+
+    def jump(self):
+        """Jump for one time step.
+        """
+        self.act(1)
+
+    def duck(self):
+        """Duck for one time step.
+        """
+        self.act(2)
+
+    def start(self):
+        """Start a new game: move to the next state of the replay.
+        """
+        self.act(0)
+
+
+def synthetic_agent(args, n_transitions, rng):
+    """Create an agent whose approximate MDP is estimated from random transitions.
+    """
+    agent = AIAgent(args, None)
+    states = random_states(args, n_transitions + 1, rng)
+    previous_states = {key: array[:-1] for key, array in states.items()}
+    new_states = {key: array[1:] for key, array in states.items()}
+    agent.update_mdp_counts_batch(previous_states, rng.randint(2, size=n_transitions), new_states,
+                                  rng.rand(n_transitions) < CRASH_PROBABILITY)
+    return agent
+
+
+def median_time(run, n_repeats, setup=None):
+    """Time several runs of a function.
+
+    Args:
+        'run' (function): function to time, called with the result of 'setup'
+        'n_repeats' (int): number of runs
+        'setup' (function, default=None): untimed function called before each run
+
+    Return:
+        'time' (float): median wall time of a run (in s)
+    """
+    times = np.zeros(n_repeats)
+    for i in range(n_repeats):
+        run_args = (setup(),) if setup else ()
+        start_time = time.perf_counter()
+        run(*run_args)
+        times[i] = time.perf_counter() - start_time
+    return np.median(times)
+
+
+def read_mdp_data(mdp_data):
+    """Read all the arrays of the approximate MDP parameters, so that the memory-mapped ones are loaded from the disk.
+    """
+    arrays = []
+    for item in mdp_data.values():
+        if isinstance(item, SparseTransitions):
+            arrays += [getattr(item, field) for field in SparseTransitions.FIELDS]
+        elif isinstance(item, np.ndarray):
+            arrays.append(item)
+        elif isinstance(item, list):
+            arrays += [array for array in item if isinstance(array, np.ndarray)]
+    return sum(float(np.sum(array)) for array in arrays)
+
+
+def run_benchmarks(args):
+    """Run all the benchmarks.
+
+    Args:
+        'args' (ArgumentParser): parser gethering the benchmark parameters
+
+    Return:
+        'results' (dict): result of each benchmark: 'value', 'unit' and whether 'higher' values are better
+    """
+    rng = np.random.RandomState(0)
+    results = {}
+
+    states = state_dicts(random_states(args, args.n_calls, rng))
+    crashes = rng.rand(args.n_calls) < CRASH_PROBABILITY
+    agent = AIAgent(args, FakeDino(states, crashes))
+
+    # discretization of one state
+    def discretize():
+        for state in states:
+            agent.get_closest_state_idx(state)
+    results['get_closest_state_idx'] = {'value': args.n_calls / median_time(discretize, args.n_repeats), 'unit': "calls/s", 'higher': True}
+
+    # recording of one transition
+    def record():
+        for i in range(1, args.n_calls):
+            agent.update_mdp_counts(states[i - 1], i % 2, states[i], 0, crashes[i])
+    results['update_mdp_counts'] = {'value': (args.n_calls - 1) / median_time(record, args.n_repeats), 'unit': "calls/s", 'higher': True}
+
+    # full control step with the fake Dino
+    agent.update_mdp_parameters()
+    agent.state = agent.dino.get_state()
+    def control():
+        for _ in range(args.n_calls):
+            agent.choose_action()
+            agent.set_transition()
+    results['agent_step'] = {'value': args.n_calls / median_time(control, args.n_repeats), 'unit': "steps/s", 'higher': True}
+
+    # latency of the greedy action
+    latencies = np.zeros(args.n_calls)
+    for i, state in enumerate(states):
+        start_time = time.perf_counter()
+        agent.best_action(state)
+        latencies[i] = time.perf_counter() - start_time
+    results['best_action_p50'] = {'value': 1e6 * np.percentile(latencies, 50), 'unit': "us", 'higher': False}
+    results['best_action_p99'] = {'value': 1e6 * np.percentile(latencies, 99), 'unit': "us", 'higher': False}
+
+    # model update and solve on several discretizations
+    for n_t, n_y in SOLVE_GRIDS:
+        grid_args = argparse.Namespace(**vars(args))
+        grid_args.n_t, grid_args.n_y = n_t, n_y
+        seed = rng.randint(2**31)
+
+        # each solve starts from the same fresh agent
+        def new_agent():
+            return synthetic_agent(grid_args, args.n_transitions, np.random.RandomState(seed))
+        solve_time = median_time(lambda grid_agent: grid_agent.update_mdp_parameters(), args.n_repeats, new_agent)
+
+        # peak memory in a separate run: tracing the allocations slows the solve down
+        grid_agent = new_agent()
+        tracemalloc.start()
+        grid_agent.update_mdp_parameters()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        name = 'update_mdp_parameters_{}x{}'.format(n_t, n_y)
+        results[name + '_time'] = {'value': solve_time, 'unit': "s", 'higher': False}
+        results[name + '_memory'] = {'value': peak_memory / 2**20, 'unit': "MiB", 'higher': False}
+
+    # checkpoint round trip: the memory-mapped arrays are read to time their loading
+    save_dirname = os.path.join(tempfile.mkdtemp(), "ai_save")
+    def round_trip():
+        save_agent(grid_agent, save_dirname)
+        loaded_agent = AIAgent(grid_args, None)
+        load_agent(loaded_agent, save_dirname)
+        read_mdp_data(loaded_agent.mdp_data)
+    try:
+        results['save_load_round_trip'] = {'value': median_time(round_trip, args.n_repeats), 'unit': "s", 'higher': False}
+    finally:
+        shutil.rmtree(os.path.dirname(save_dirname))
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compare benchmark results with a baseline.
+
+    Args:
+        'results', 'baseline' (dict): benchmark results, see 'run_benchmarks'
+        'threshold' (float): relative slowdown above which a benchmark is flagged as a regression
+
+    Return:
+        'regressions' (list of str): names of the regressed benchmarks
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        # relative change, positive if worse
+        reference = baseline[name]['value']
+        change = (reference - result['value']) / reference if result['higher'] else (result['value'] - reference) / reference
+        flag = "REGRESSION" if change > threshold else ""
+        print("{:<42}{:>14.4g}{:>14.4g} {:<8}{:>+8.1%} {}".format(name, reference, result['value'], result['unit'], -change, flag))
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    # get arguments needed to run the benchmarks
+    args = get_bench_args()
+
+    results = run_benchmarks(args)
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    for name, result in results.items():
+        print("{:<42}{:>14.4g} {}".format(name, result['value'], result['unit']))
+
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        print("\n{:<42}{:>14}{:>14}".format("Comparison with " + args.baseline, "baseline", "current"))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            raise SystemExit("Regressions: {}".format(", ".join(regressions)))
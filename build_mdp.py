@@ -0,0 +1,81 @@
+"""Build the approximate MDP of the AI agent offline from transition logs.
+
+Authors:
+    Gael Colas
+
+Remarks:
+    The logged transitions are binned and counted in one vectorized pass per chunk, with the discretization and the reward function of the current arguments and code.
+    The resulting agent is saved as a checkpoint that 'train.py --load_save True' accepts.
+"""
+
+import argparse
+import time
+
+from args import add_env_args, add_sim_args, add_RL_args
+from agent import AIAgent
+from translog import read_transitions
+from util import save_agent
+
+# number of logged transitions processed at once
+CHUNK_SIZE = 1 << 20
+
+
+def get_build_args():
+    """Get arguments needed to build the approximate MDP."""
+
+    parser = argparse.ArgumentParser('Build the approximate MDP of the AI agent from transition logs.')
+
+    # same arguments as the Game: discretization, solver and checkpoint name
+    add_env_args(parser)
+    add_sim_args(parser)
+    add_RL_args(parser)
+
+    parser.add_argument('logs',
+                        type=str,
+                        nargs='+',
+                        help="Transition logs recorded with '--transition_log'.")
+
+    args = parser.parse_args()
+
+    return args
+
+
+def build_agent(args, log_filenames):
+    """Build an AI agent whose approximate MDP is estimated from transition logs.
+
+    Args:
+        'args' (ArgumentParser): parser gethering all the Game parameters
+        'log_filenames' (list of str): names of the transition logs
+
+    Return:
+        'agent' (AIAgent): AI agent without Dino controller, with the solved approximate MDP
+        'n_transitions' (int): number of transitions read
+    """
+    agent = AIAgent(args, None)
+
+    n_transitions = 0
+    for log_filename in log_filenames:
+        records = read_transitions(log_filename)
+        for start in range(0, records.size, CHUNK_SIZE):
+            chunk = records[start:start + CHUNK_SIZE]
+            # the rewards are recomputed with the current reward function
+            agent.update_mdp_counts_batch(chunk['state'], chunk['action'], chunk['new_state'], chunk['crashed'])
+        n_transitions += records.size
+
+    # estimate the transition and reward functions, and solve the MDP
+    agent.update_mdp_parameters()
+
+    return agent, n_transitions
+
+
+if __name__ == '__main__':
+    # get arguments needed to build the approximate MDP
+    args = get_build_args()
+
+    start_time = time.time()
+    agent, n_transitions = build_agent(args, args.logs)
+
+    print("Built the approximate MDP from {} transitions in {:.2f} s".format(n_transitions, time.time() - start_time))
+    print("Solver {solver}: {iterations} iterations, residual {residual:.4f}, {time:.3f} s".format(**agent.solve_stats))
+
+    save_agent(agent, args.save_filename)
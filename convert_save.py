@@ -0,0 +1,23 @@
+"""Convert an agent saved to a JSON file by older versions to a binary checkpoint.
+
+Authors:
+    Gael Colas
+"""
+
+import argparse
+
+from util import read_json_save, write_checkpoint
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Convert a JSON agent save to a binary checkpoint.')
+    parser.add_argument('in_filename',
+                        type=str,
+                        help="Name of the JSON file saving the agent parameters.")
+    parser.add_argument('out_dirname',
+                        type=str,
+                        help="Name of the checkpoint directory to create.")
+    args = parser.parse_args()
+    
+    write_checkpoint(read_json_save(args.in_filename), args.out_dirname)
+    print("The AI agent saved in {} has been converted to: {}".format(args.in_filename, args.out_dirname))
@@ -6,20 +6,123 @@ Authors:
 
 import time
 
+import numpy as np
+
 from game import Game
+from sim import SimGame, FPS
+
+# number of ticks between two adaptations of the period, and margin of the period over the p95 latency
+ADAPT_EVERY = 100
+ADAPT_MARGIN = 1.2
+# maximum waiting time (in s) for a game event while the agent is not playing
+EVENT_TIMEOUT = 1.
+
+
+class DeadlineScheduler:
+    """'DeadlineScheduler' class: run the control loop at a fixed rate, on absolute deadlines of the monotonic clock.
+    Each tick only sleeps for what is left of its budget after the game round trips and the agent computations.
+    
+    Attributes:
+        'dt' (float): requested period of the ticks (in s)
+        'period' (float): current period of the ticks (in s), adapted to the latency if 'adaptive'
+        'adaptive' (bool): whether the period is adapted to the p95 latency of the ticks
+        'deadline' (float): end of the current tick (monotonic clock, in s), None before the first tick
+        'tick_start' (float): start of the current tick (monotonic clock, in s)
+        'latencies' (np.array): ring buffer of the busy time of the last ticks (in s)
+        'ticks' (int): number of ticks
+        'overruns' (int): number of ticks whose busy time exceeded the period
+    """
+    def __init__(self, dt, adaptive=False, history=1000):
+        self.dt = dt
+        self.period = dt
+        self.adaptive = adaptive
+        self.deadline = None
+        self.tick_start = None
+        self.latencies = np.zeros(history)
+        self.ticks = 0
+        self.overruns = 0
+        
+    def reset(self):
+        """Start a new sequence of ticks, for instance after a restart of the game.
+        """
+        self.deadline = None
+        
+    def remaining(self):
+        """Get the time left before the deadline of the current tick (in s).
+        """
+        if self.deadline is None:
+            return self.period
+        return max(self.deadline - time.monotonic(), 0.)
+        
+    def wait(self, game):
+        """Wait for the deadline of the current tick, and start the next tick.
+        
+        Args:
+            'game' (Game or SimGame): game whose 'wait' is used to sleep
+            
+        Remarks:
+            An overrun tick is not caught up: the next deadline is set one period after the end of the overrun.
+        """
+        now = time.monotonic()
+        if self.deadline is None: # first tick
+            self.tick_start, self.deadline = now, now + self.period
+        
+        # busy time of the tick
+        self.latencies[self.ticks % self.latencies.size] = now - self.tick_start
+        self.ticks += 1
+        
+        if now < self.deadline:
+            game.wait(self.deadline - now)
+            self.tick_start = self.deadline
+        else:
+            self.overruns += 1
+            self.tick_start = now
+        self.deadline = self.tick_start + self.period
+        
+        # adapt the period to the measured latency
+        if self.adaptive and self.ticks % ADAPT_EVERY == 0:
+            self.period = max(self.dt, ADAPT_MARGIN * self.p95_latency())
+            
+    def p95_latency(self):
+        """Get the 95th percentile of the busy time of the last ticks (in s).
+        """
+        n = min(self.ticks, self.latencies.size)
+        return np.percentile(self.latencies[:n], 95) if n else 0.
+        
+    def get_stats(self):
+        """Get the statistics of the scheduler.
+        
+        Return:
+            'stats' (dict): number of 'ticks' and of 'overruns', current 'period' and 'p95_latency' (in s)
+        """
+        return {'ticks': self.ticks, 'overruns': self.overruns, 'period': self.period, 'p95_latency': self.p95_latency()}
 
 
 class Dino:
     """'Dino' class: control the Dino character.
     
     Attributes:
-        'game' (Game): interface between Python and Chrome Javascript
+        'game' (Game or SimGame): interface between Python and Chrome Javascript, or headless simulator
+        'snap' (dict): last snapshot of the game state, see 'Game.snapshot'
+        'frame_step' (bool): whether the game is stepped frame by frame instead of running in real time
+        'n_frames' (int): number of frames per time step, in frame-stepped mode
+        'scheduler' (DeadlineScheduler): fixed-rate scheduler of the time steps in the real-time Chrome game, None otherwise
     """
     def __init__(self, args):
         super(Dino).__init__()
         
         self.dt = args.dt
-        self.game = Game(args)
+        self.frame_step = args.frame_step
+        self.n_frames = max(1, int(round(args.dt * FPS)))
+        if args.env == "sim":
+            self.game = SimGame(args)
+        else:
+            self.game = Game(args)
+        # the simulator and the frame-stepped game do not run on the wall clock
+        self.scheduler = None
+        if args.env == "chrome" and not args.frame_step:
+            self.scheduler = DeadlineScheduler(args.dt, args.adaptive_dt)
+        self.snap = None
         self.start()
         
     def start(self):
@@ -29,53 +132,118 @@ class Dino:
             For the first game: jump to start the game.
         """
         if self.game.get_n_sim() == 0: # first game
-            self.jump()
+            self.game.press_up()
+            self.run()
         else: # next games
             self.game.restart()
+            self.refresh()
+        
+        # the ticks of the new game start now
+        if self.scheduler:
+            self.scheduler.reset()
+    
+    def refresh(self):
+        """Get a new snapshot of the game state.
+        
+        Remarks:
+            The state getters below read this snapshot: it is refreshed once per action.
+        """
+        self.snap = self.game.snapshot()
+    
+    def wait_events(self, timeout=EVENT_TIMEOUT):
+        """Wait for a game event (game over, restart, pause or resume), then get a new snapshot of the game state.
+        
+        Args:
+            'timeout' (float): maximum waiting time (in s)
+            
+        Return:
+            'events' (list of dict): game events since the last call, see 'Game.wait_events'
+        """
+        events = self.game.wait_events(timeout)
+        self.refresh()
+        
+        # the ticks start again after the wait
+        if self.scheduler:
+            self.scheduler.reset()
+        return events
+    
+    def resume(self):
+        """Resume a paused game, then get a new snapshot of the game state.
+        """
+        self.game.resume()
+        self.refresh()
+        
+        # the ticks of the resumed game start now
+        if self.scheduler:
+            self.scheduler.reset()
+    
+    def act(self, action):
+        """Perform an action and let the game run for one time step.
+        
+        Args:
+            'action' (int): action = 1 if 'jumping', 2 if 'ducking', 0 otherwise
+        """
+        if self.frame_step:
+            # action, frames and snapshot in a single round trip
+            self.snap = self.game.advance(self.n_frames, action)
+            return
+        
+        if self.scheduler:
+            # action in a single round trip: a duck is released by the page at the deadline of the time step
+            if action:
+                self.game.send_action(action, self.scheduler.remaining())
+            self.scheduler.wait(self.game)
+            self.refresh()
+            return
+        
+        if action == 1:
+            self.game.press_up()
+        
+        if action == 2:
+            self.game.set_duck(self.dt)
+        else:
+            self.game.wait(self.dt)
+        self.refresh()
     
     def run(self):
         """Do nothing (run).
         """
-        time.sleep(self.dt)
+        self.act(0)
     
     def jump(self):
         """Make the Dino jump.
         """
-        self.game.press_up()
-        time.sleep(self.dt)
+        self.act(1)
         
     def duck(self):
         """Make the Dino duck.
         """
-        self.game.set_duck(self.dt)
+        self.act(2)
         
     def get_state(self):
         """Get the state of the Dino.
         """
-        # current dino state
-        dino_state = self.game.get_dino_state()
-        # next obstacle state
-        obstacle_state = self.game.get_obstacle()
-          
-        if not obstacle_state: # no obstacle created yet
+        if not self.snap['type']: # no obstacle created yet
             return None
-          
-        # combined state
-        obstacle_state.update(dino_state)
         
-        obstacle_state['dt'] = obstacle_state['dx'] / (100*obstacle_state['speed'])
+        # next obstacle state
+        state = {key: self.snap[key] for key in ('type', 'config', 'width', 'dx')}
+        # current dino state
+        state.update({'status': self.snap['status'], 'y': self.snap['yPos'], 'speed': self.snap['speed']})
+        
+        state['dt'] = state['dx'] / (100*state['speed'])
         
-        return obstacle_state
+        return state
         
     def is_playing(self):
         """Check if the game is playing (ie not paused and not game over). 
         """
-        return self.game.get_playing()
+        return self.snap['playing']
         
     def is_crashed(self):
         """Check if the agent has crashed on an obstacle.
         """
-        return self.game.get_crashed()
+        return self.snap['crashed']
     
     def get_score(self):
         """Get the current score.
@@ -83,7 +251,7 @@ class Dino:
         Return:
             'score' (int): current score
         """
-        score = self.game.get_score()
+        score = int(''.join(self.snap['digits']))
         return score
         
     def get_n_sim(self):
@@ -92,10 +260,10 @@ class Dino:
         Return:
             'n_sim' (int): number of simulations played
         """
-        n_sim = self.game.get_n_sim()
+        n_sim = self.snap['playCount']
         return n_sim
         
     def quit(self):
         """Quit the game.
         """
-        self.game.end()
\ No newline at end of file
+        self.game.end()
@@ -14,6 +14,121 @@ from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 
 from args import get_game_args
+from sim import FPS
+
+# Javascript function returning a compact snapshot of the game state in a single round trip
+SNAPSHOT_SCRIPT = """
+var runner = Runner.instance_, tRex = runner.tRex, obstacles = runner.horizon.obstacles;
+var obstacle = obstacles[0];
+if (obstacles.length > 1 && obstacle.xPos < tRex.xPos) { obstacle = obstacles[1]; }
+var isPterodactyl = obstacle && obstacle.typeConfig.type == 'PTERODACTYL';
+return {
+    crashed: runner.crashed, playing: runner.playing,
+    digits: runner.distanceMeter.digits, playCount: runner.playCount,
+    status: tRex.status, yPos: tRex.yPos, xPos: tRex.xPos, speed: runner.currentSpeed,
+    type: obstacle ? obstacle.typeConfig.type : null,
+    config: obstacle ? (isPterodactyl ? obstacle.yPos : obstacle.size) : null,
+    width: obstacle ? obstacle.width : null,
+    dx: obstacle ? obstacle.xPos : null
+};
+"""
+
+# Javascript function stopping the animation loop of the game: the game clock only advances with the stepped frames
+FRAME_STEP_SCRIPT = """
+var runner = Runner.instance_;
+if (!window.frameClock_) {
+    window.frameClock_ = performance.now();
+    performance.now = function() { return window.frameClock_; };
+    cancelAnimationFrame(runner.raqId);
+    runner.scheduleNextUpdate = function() {};
+    runner.time = window.frameClock_;
+}
+"""
+
+# Javascript function performing an action and stepping the game for a given number of frames, then taking a snapshot
+ADVANCE_SCRIPT = """
+var runner = Runner.instance_, tRex = runner.tRex, nFrames = arguments[0], action = arguments[1], msPerFrame = arguments[2];
+if (action == 1 && !tRex.jumping && !tRex.ducking) { tRex.startJump(runner.currentSpeed); }
+if (action == 2) { if (tRex.jumping) { tRex.setSpeedDrop(); } else { tRex.setDuck(true); } }
+for (var i = 0; i < nFrames && runner.playing; i++) {
+    window.frameClock_ += msPerFrame;
+    runner.update();
+}
+if (action == 2 && tRex.ducking) { tRex.setDuck(false); }
+""" + SNAPSHOT_SCRIPT
+
+# Javascript function performing an action in the running game: the release of a duck is scheduled inside the page
+ACTION_SCRIPT = """
+var runner = Runner.instance_, tRex = runner.tRex, action = arguments[0], duckMs = arguments[1];
+if (!runner.playing) { return false; }
+if (action == 1 && !tRex.jumping && !tRex.ducking) { tRex.startJump(runner.currentSpeed); }
+if (action == 2) {
+    if (tRex.jumping) { tRex.setSpeedDrop(); }
+    else {
+        tRex.setDuck(true);
+        clearTimeout(window.duckTimer_);
+        window.duckTimer_ = setTimeout(function() { if (tRex.ducking) { tRex.setDuck(false); } }, duckMs);
+    }
+}
+return true;
+"""
+
+# Javascript function recording the game events of the Runner in a queue of the page
+EVENTS_SCRIPT = """
+if (!window.gameEvents_) {
+    window.gameEvents_ = [];
+    ['gameOver', 'restart', 'stop', 'play'].forEach(function(name) {
+        var method = Runner.prototype[name];
+        Runner.prototype[name] = function() {
+            var result = method.apply(this, arguments);
+            window.gameEvents_.push({type: name, playCount: this.playCount, time: performance.now()});
+            if (window.eventWaiter_) { window.eventWaiter_(); }
+            return result;
+        };
+    });
+}
+"""
+
+# Javascript function waiting for game events, called asynchronously: returns the queued events, or an empty list after the timeout
+WAIT_EVENTS_SCRIPT = """
+var timeoutMs = arguments[0], callback = arguments[arguments.length - 1];
+function drain() {
+    clearTimeout(window.eventTimer_);
+    window.eventWaiter_ = null;
+    callback(window.gameEvents_.splice(0));
+}
+if (window.gameEvents_.length) { drain(); }
+else {
+    window.eventWaiter_ = drain;
+    window.eventTimer_ = setTimeout(drain, timeoutMs);
+}
+"""
+
+# Javascript function replacing 'Math.random' by a seeded generator (mulberry32), reseeded at each restart with the number of the simulation
+SEED_SCRIPT = """
+var seed = arguments[0];
+window.seedRandom_ = function(playCount) {
+    var state = (Math.imul(seed, 1000003) + playCount) >>> 0;
+    Math.random = function() {
+        state = (state + 0x6D2B79F5) >>> 0;
+        var t = Math.imul(state ^ (state >>> 15), state | 1);
+        t ^= t + Math.imul(t ^ (t >>> 7), t | 61);
+        return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+    };
+};
+if (!window.seedHooked_) {
+    window.seedHooked_ = true;
+    var restart = Runner.prototype.restart;
+    Runner.prototype.restart = function() {
+        window.seedRandom_(this.playCount + 1);
+        return restart.apply(this, arguments);
+    };
+}
+window.seedRandom_(Math.max(Runner.instance_.playCount, 1));
+"""
+
+# maximum time (in s) a script called asynchronously can wait
+SCRIPT_TIMEOUT = 10.
 
 
 class Game:
@@ -21,6 +136,7 @@ class Game:
     
     Attributes:
         '_drive' (selenium.webdriver): Chrome Webdriver 
+        '_body' (selenium.webdriver.remote.webelement.WebElement): body of the page receiving the keys, looked up once
     """
     def __init__(self, args):
         """Launch the browser window.
@@ -34,6 +150,7 @@ class Game:
         
         # launch the Chrome browser window
         self._driver = webdriver.Chrome(executable_path = args.chrome_driver_path, chrome_options=chrome_options)
+        self._body = None
         
         # size and position of the window
         #self._driver.set_window_position(x=-10,y=0)
@@ -49,7 +166,8 @@ class Game:
         """Set the parameters of the simulation.
         
         Remarks:
-            The settable parameters are: initial and maximum speed of the dino, acceleration of the dino.
+            The settable parameters are: initial and maximum speed of the dino, acceleration of the dino, seed of the obstacles.
+            The clouds also draw random numbers: the obstacles only replay exactly when the frames are stepped ('frame_step').
         """
         # set the initial speed for the first and the next simulations
         self._driver.execute_script("Runner.instance_.currentSpeed = {}".format(args.initial_speed))
@@ -61,6 +179,18 @@ class Game:
         # set the initial free time
         self._driver.execute_script("Runner.instance_.config.CLEAR_TIME = {}".format(args.clear_time))
         
+        # seed the random generator of the page
+        if args.seed is not None:
+            self._driver.execute_script(SEED_SCRIPT, args.seed)
+        
+        # record the game events
+        self._driver.execute_script(EVENTS_SCRIPT)
+        self._driver.set_script_timeout(SCRIPT_TIMEOUT)
+        
+        # stop the animation loop of the game
+        if args.frame_step:
+            self._driver.execute_script(FRAME_STEP_SCRIPT)
+        
         # set the game sprite
         if args.dino_sprite_1x:
             # open the image
@@ -146,36 +276,101 @@ class Game:
         # sleep at the beginning because there is no obstacle
         #time.sleep(0.25)# no actions are possible for 0.25 sec after game starts, 
         
+    def send_action(self, action, duck_time=0.):
+        """Perform an action in the running game, in a single round trip.
+        
+        Args:
+            'action' (int): action to perform: 1 if 'jumping', 2 if 'ducking', 0 otherwise
+            'duck_time' (float): how long (in s) the Dino has to duck
+            
+        Return:
+            'isPlaying' (bool): False if the game is not running, then the action is ignored
+            
+        Remarks:
+            When jumping, ducking becomes a speed drop.
+            The duck is released by a timer of the page: the call returns immediately. A new duck postpones the release.
+        """
+        # send a Javascript signal to Chrome
+        return self._driver.execute_script(ACTION_SCRIPT, action, 1000. * duck_time)
+        
+    def send_key(self, key):
+        """Send a key to the page.
+        
+        Args:
+            'key' (str): Selenium key to send
+        """
+        if self._body is None:
+            self._body = self._driver.find_element_by_tag_name("body")
+        self._body.send_keys(key)
+        
     def press_up(self):
         """Press the UP Arrow key.
+        
+        Remarks:
+            The key is only sent when the game is not running, for instance to start the first game.
         """
-        # send a Javascript signal to Chrome
-        self._driver.find_element_by_tag_name("body").send_keys(Keys.ARROW_UP)
+        if not self.send_action(1):
+            self.send_key(Keys.ARROW_UP)
         
     def press_down(self):
         """Press the DOWN Arrow key.
         """
-        # send a Javascript signal to Chrome
-        self._driver.find_element_by_tag_name("body").send_keys(Keys.ARROW_DOWN)
+        if not self.send_action(2):
+            self.send_key(Keys.ARROW_DOWN)
         
     def set_duck(self, duck_time):
         """Make the Dino duck for the specified amount of time.
         
         Args:
             'duck_time' (float): how long (in s) the Dino has to duck
+            
+        Remarks:
+            The call does not block: the Dino keeps ducking in the page while the game is observed.
         """
-        # check if the Dino is currently jumping
-        isJumping = self._driver.execute_script("return Runner.instance_.tRex.jumping")
-        
-        if isJumping:
-            # if jumping: speed drop, activated only when jump key is not pressed
-            self._driver.execute_script("return Runner.instance_.tRex.setSpeedDrop()")
-        else:
-            # otherwise duck
-            self._driver.execute_script("return Runner.instance_.tRex.setDuck(true)")
-            time.sleep(duck_time)
-            self._driver.execute_script("return Runner.instance_.tRex.setDuck(false)")        
+        self.send_action(2, duck_time)
 
+    def wait(self, duration):
+        """Let the game run for the specified amount of time.
+        
+        Args:
+            'duration' (float): how long (in s) the game has to run
+        """
+        time.sleep(duration)
+        
+    def advance(self, n_frames, action=0):
+        """Perform an action and step the game for the specified number of frames.
+        
+        Args:
+            'n_frames' (int): number of frames to simulate
+            'action' (int): action to perform: 1 if 'jumping', 2 if 'ducking' during the frames, 0 otherwise
+            
+        Return:
+            'snap' (dict): snapshot of the game state after the frames, see 'snapshot'
+            
+        Remarks:
+            Only available if the animation loop has been stopped with the 'frame_step' argument.
+            The Runner is updated inside the page with a synthetic timestamp: the result does not depend on the driver latency.
+        """
+        # send a Javascript signal to Chrome
+        snap = self._driver.execute_script(ADVANCE_SCRIPT, n_frames, action, 1000. / FPS)
+        return snap
+        
+    def wait_events(self, timeout):
+        """Wait for game events: game over, restart, pause ('stop') or resume ('play').
+        
+        Args:
+            'timeout' (float): maximum waiting time (in s), below 'SCRIPT_TIMEOUT'
+            
+        Return:
+            'events' (list of dict): 'type', 'playCount' and page 'time' (in ms) of the events since the last call, empty after the timeout
+            
+        Remarks:
+            A single asynchronous call: the page answers as soon as an event is recorded, no polling is done.
+        """
+        # send a Javascript signal to Chrome
+        events = self._driver.execute_async_script(WAIT_EVENTS_SCRIPT, 1000. * timeout)
+        return events
+        
     def pause(self):
         """Pause the game.
         """
@@ -191,6 +386,23 @@ class Game:
         """
         self._driver.close()
         
+    def snapshot(self):
+        """Get a snapshot of the game state in a single round trip.
+        
+        Return:
+            'snap' (dict): flat record of the game state
+            
+        Remarks:
+            The information gathered:
+                - 'crashed', 'playing': same as 'get_crashed' and 'get_playing'
+                - 'digits': score digits, 'playCount': number of simulations played
+                - 'status', 'yPos', 'xPos' of dino, 'speed': current speed of dino
+                - 'type', 'config', 'width', 'dx' of the next obstacle: same as 'get_obstacle', None if no obstacle
+        """
+        # send a Javascript signal to Chrome
+        snap = self._driver.execute_script(SNAPSHOT_SCRIPT)
+        return snap
+        
     def get_obstacle(self):
         """Get the information about the next obstacle.
         
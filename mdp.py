@@ -0,0 +1,351 @@
+"""Sparse storage and state discretization of the approximate Markov Decision Process.
+
+Authors:
+    Gael Colas
+"""
+
+import math
+
+import numpy as np
+
+# code of each handled type of obstacle
+OBSTACLE_TYPES = {'CACTUS_SMALL': 0, 'CACTUS_LARGE': 1, 'PTERODACTYL': 2}
+PTERODACTYL_TYPE = OBSTACLE_TYPES['PTERODACTYL']
+
+
+class UniformGrid:
+    """Uniform grid of points: the closest point to a value is found with pure arithmetic.
+
+    Attributes:
+        'start' (float): first point of the grid
+        'step' (float): distance between two successive points
+        'size' (int): number of points
+    """
+    def __init__(self, points):
+        points = np.asarray(points, dtype=float)
+        self.start = float(points[0])
+        self.step = float(points[-1] - points[0]) / (points.size - 1) if points.size > 1 else 1.
+        self.size = points.size
+
+    def closest(self, value):
+        """Get the index of the closest point to a scalar value.
+        """
+        # round half down: same tie-breaking as 'np.argmin'
+        idx = math.ceil((value - self.start) / self.step - 0.5)
+        return min(max(idx, 0), self.size - 1)
+
+    def closest_many(self, values):
+        """Get the indices of the closest points to an array of values.
+        """
+        idx = np.ceil((np.asarray(values, dtype=float) - self.start) / self.step - 0.5)
+        return np.clip(idx, 0, self.size - 1).astype(np.int64)
+
+
+class StateBinning:
+    """Map the states of the Dino to the indices of the closest discretized states in O(1).
+    The state of the Dino is defined by: the time to the next obstacle (dt), the height of the dino (y), and if the obstacle is a Pterodactyl, its flight level.
+
+    Attributes:
+        'dt_grid', 'dy_grid', 'dy_pter_grid' (UniformGrid): discretization of dt, y and of the pterodactyl flight levels
+
+    Remarks:
+        State 0 is a FAIL state ; State 1 is a NO_OBSTACLE state.
+        The discretizations must be uniform, as created by 'np.linspace'.
+    """
+    def __init__(self, dt_s, dy_s, dy_pter_s):
+        self.dt_grid = UniformGrid(dt_s)
+        self.dy_grid = UniformGrid(dy_s)
+        self.dy_pter_grid = UniformGrid(dy_pter_s)
+
+    def index(self, state, isFail=False):
+        """Get the index of the closest discretized state.
+
+        Args:
+            'state' (dict): the current state of the Dino
+            'isFail' (bool): whether the Game is failed
+
+        Return:
+            'ind' (int): index of the closest discretized state
+        """
+        if not state: # no obstacle created yet
+            return 1
+        if isFail:
+            return 0
+
+        if state['type'] == "PTERODACTYL":
+            i = self.dy_pter_grid.closest(state['config'])
+        else:
+            i = self.dy_pter_grid.size
+
+        # closest discretized state indices
+        j = self.dt_grid.closest(state['dt'])
+        k = self.dy_grid.closest(state['y'])
+
+        return (i*self.dt_grid.size + j)*self.dy_grid.size + k + 2
+
+    def indices(self, states, isFail=None):
+        """Vectorized version of 'index'.
+
+        Args:
+            'states' (dict of np.array): states of the Dino, with the obstacle 'type' given by its code in 'agent.OBSTACLE_TYPES' (-1 if no obstacle)
+            'isFail' (np.array of bool, default=None): whether the Game is failed in each state
+
+        Return:
+            'ind' (np.array of int): indices of the closest discretized states
+        """
+        obs_type = np.asarray(states['type'])
+
+        # closest discretized state indices
+        i = np.where(obs_type == PTERODACTYL_TYPE, self.dy_pter_grid.closest_many(states['config']), self.dy_pter_grid.size)
+        j = self.dt_grid.closest_many(states['dt'])
+        k = self.dy_grid.closest_many(states['y'])
+
+        ind = (i*self.dt_grid.size + j)*self.dy_grid.size + k + 2
+        if isFail is not None:
+            ind[np.asarray(isFail, dtype=bool)] = 0
+        # no obstacle created yet
+        ind[obs_type < 0] = 1
+
+        return ind
+
+
+class SparseTransitions:
+    """Sparse transition counts of the approximate MDP, with lazily normalized transition probabilities.
+    Each (state, action) pair only ever reaches a handful of successors: only the observed transitions are stored.
+    The transitions are stored in the COO format, sorted by row (state, action) then by column (new state).
+
+    Attributes:
+        'num_states' (int): number of discretized states
+        'num_actions' (int): number of actions
+
+        'rows' (np.array of int): row index 'state*num_actions + action' of each stored transition
+        'cols' (np.array of int): new state index of each stored transition
+        'counts' (np.array of float): number of times each stored transition occurred
+        'indptr' (np.array of int): the transitions of row r are stored in [indptr[r], indptr[r+1])
+
+    Remarks:
+        The transitions recorded with 'add' and 'add_many' are buffered: they are only taken into account after the next call to 'compact'.
+        The (state, action) pairs never observed have a uniform transition probability: p(x'|x,a) = 1/num_states.
+    """
+    # arrays defining the stored transitions
+    FIELDS = ('rows', 'cols', 'counts', 'indptr')
+
+    def __init__(self, num_states, num_actions=2):
+        self.num_states = num_states
+        self.num_actions = num_actions
+
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.cols = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0)
+        self.indptr = np.zeros(num_states*num_actions + 1, dtype=np.int64)
+
+        # buffered transitions
+        self._pending_keys = []
+        self._pending_batches = []
+        # lazily normalized transition probabilities
+        self._probs = None
+
+    def add(self, state, action, new_state):
+        """Record one occurrence of the transition 'state, action, new_state'.
+        """
+        self._pending_keys.append((state*self.num_actions + action)*self.num_states + new_state)
+
+    def add_many(self, states, actions, new_states, counts=None):
+        """Record a batch of transitions.
+
+        Args:
+            'states', 'actions', 'new_states' (np.array of int): transitions to record
+            'counts' (np.array of float, default=None): number of occurrences of each transition, 1 if None
+        """
+        keys = (np.asarray(states, dtype=np.int64)*self.num_actions + actions)*self.num_states + new_states
+        if counts is None:
+            counts = np.ones(keys.size)
+        self._pending_batches.append((keys.ravel(), np.asarray(counts, dtype=float).ravel()))
+
+    def compact(self):
+        """Merge the buffered transitions into the sorted storage.
+
+        Return:
+            'changed_rows' (np.array of int): rows 'state*num_actions + action' that received new transitions
+        """
+        if not self._pending_keys and not self._pending_batches:
+            return np.zeros(0, dtype=np.int64)
+
+        keys = [self.rows*self.num_states + self.cols, np.array(self._pending_keys, dtype=np.int64)]
+        weights = [self.counts, np.ones(len(self._pending_keys))]
+        for batch_keys, batch_counts in self._pending_batches:
+            keys.append(batch_keys)
+            weights.append(batch_counts)
+        self._pending_keys = []
+        self._pending_batches = []
+
+        changed_rows = np.unique(np.concatenate(keys[1:]) // self.num_states)
+
+        # sum the counts of identical transitions
+        unique_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate(weights), minlength=unique_keys.size)
+        self.rows, self.cols = np.divmod(unique_keys, self.num_states)
+        self.indptr = np.searchsorted(self.rows, np.arange(self.num_states*self.num_actions + 1))
+
+        self._probs = None
+
+        return changed_rows
+
+    def copy(self):
+        """Copy the stored transitions, with their buffered transitions.
+        The compacted arrays are never modified in place (they are replaced by 'compact'): they are shared, not copied.
+
+        Return:
+            'transitions' (SparseTransitions): copy that can be compacted without changing these transitions
+        """
+        transitions = SparseTransitions.from_arrays(self.num_states, self.num_actions, self.rows, self.cols, self.counts, self.indptr)
+        transitions._pending_keys = list(self._pending_keys)
+        transitions._pending_batches = list(self._pending_batches)
+        return transitions
+
+    def row_totals(self):
+        """Get the total number of transitions observed from each (state, action) pair.
+
+        Return:
+            'totals' (np.array, [num_states*num_actions]): number of observed transitions of each row
+        """
+        return np.bincount(self.rows, weights=self.counts, minlength=self.num_states*self.num_actions).astype(float)
+
+    def probs(self):
+        """Get the transition probabilities of the stored transitions.
+
+        Return:
+            'probs' (np.array of float): p(x'|x,a) of each stored transition, aligned with 'rows' and 'cols'
+        """
+        if self._probs is None:
+            self._probs = self.counts / self.row_totals()[self.rows]
+        return self._probs
+
+    def visited(self):
+        """Get the (state, action) pairs that have been observed.
+
+        Return:
+            'visited' (np.array of bool, [num_states, num_actions]): True if the pair has been observed
+        """
+        return (np.diff(self.indptr) > 0).reshape(self.num_states, self.num_actions)
+
+    def expected_values(self, value):
+        """Compute the expected value of the next state for every (state, action) pair: sum_x' p(x'|x,a) V(x').
+
+        Args:
+            'value' (np.array, [num_states]): value function
+
+        Return:
+            'q_values' (np.array, [num_states, num_actions]): expected next state value of each (state, action) pair
+        """
+        probs = self.probs()
+
+        # sparse matrix-vector product
+        q_values = np.bincount(self.rows, weights=probs*value[self.cols], minlength=self.num_states*self.num_actions).astype(float)
+        # uniform transition probability for the unobserved pairs
+        q_values[np.diff(self.indptr) == 0] = np.mean(value)
+
+        return q_values.reshape(self.num_states, self.num_actions)
+
+    def expected_values_row(self, state, value):
+        """Compute the expected value of the next state for every action in the given state.
+
+        Args:
+            'state' (int): index of the state
+            'value' (np.array, [num_states]): value function
+
+        Return:
+            'q_values' (np.array, [num_actions]): expected next state value of each action
+        """
+        probs = self.probs()
+
+        q_values = np.full(self.num_actions, np.mean(value))
+        for action in range(self.num_actions):
+            start, end = self.indptr[state*self.num_actions + action], self.indptr[state*self.num_actions + action + 1]
+            if end > start:
+                q_values[action] = probs[start:end].dot(value[self.cols[start:end]])
+
+        return q_values
+
+    def split_state(self, state, fraction):
+        """Add a new state by splitting an existing one in two.
+        The transitions from and to the split state are shared between the two states: the transition probabilities are unchanged.
+
+        Args:
+            'state' (int): index of the split state
+            'fraction' (float): fraction of the transitions from and to the split state kept by it, the rest goes to the new state
+
+        Return:
+            'new_state' (int): index of the new state (the last one)
+        """
+        self.compact()
+        new_state = self.num_states
+
+        # transitions from the split state: shared with the new state
+        moved = self.rows // self.num_actions == state
+        rows = np.concatenate([self.rows, self.rows[moved] + (new_state - state)*self.num_actions])
+        cols = np.concatenate([self.cols, self.cols[moved]])
+        counts = np.concatenate([np.where(moved, fraction*self.counts, self.counts), (1 - fraction)*self.counts[moved]])
+
+        # transitions to the split state: shared with the new state
+        shared = cols == state
+        rows = np.concatenate([rows, rows[shared]])
+        cols = np.concatenate([cols, np.full(shared.sum(), new_state)])
+        counts = np.concatenate([np.where(shared, fraction*counts, counts), (1 - fraction)*counts[shared]])
+
+        # sorted storage of the new shape, without the transitions kept entirely by one of the two states
+        self.num_states += 1
+        nonzero = counts > 0
+        rows, cols, counts = rows[nonzero], cols[nonzero], counts[nonzero]
+        order = np.lexsort((cols, rows))
+        self.rows, self.cols, self.counts = rows[order], cols[order], counts[order]
+        self.indptr = np.searchsorted(self.rows, np.arange(self.num_states*self.num_actions + 1))
+
+        self._probs = None
+
+        return new_state
+
+    def to_dict(self):
+        """Convert the stored transitions to a JSON serializable dictionary.
+        """
+        self.compact()
+        return {
+            'num_states': self.num_states,
+            'num_actions': self.num_actions,
+            'rows': self.rows.tolist(),
+            'cols': self.cols.tolist(),
+            'counts': self.counts.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, transitions_dict):
+        """Create the stored transitions from a dictionary created by 'to_dict'.
+        """
+        transitions = cls(transitions_dict['num_states'], transitions_dict['num_actions'])
+        rows = np.array(transitions_dict['rows'], dtype=np.int64)
+        transitions.add_many(rows // transitions.num_actions, rows % transitions.num_actions,
+                             np.array(transitions_dict['cols'], dtype=np.int64), transitions_dict['counts'])
+        transitions.compact()
+        return transitions
+
+    @classmethod
+    def from_arrays(cls, num_states, num_actions, rows, cols, counts, indptr):
+        """Create the stored transitions from the arrays of a compacted storage, without copying them.
+        """
+        transitions = cls(num_states, num_actions)
+        transitions.rows, transitions.cols, transitions.counts, transitions.indptr = rows, cols, counts, indptr
+        return transitions
+
+    @classmethod
+    def from_dense(cls, transition_counts):
+        """Create the stored transitions from dense transition counts.
+
+        Args:
+            'transition_counts' (np.array, [num_states, num_actions, num_states]): dense transition counts
+        """
+        transition_counts = np.asarray(transition_counts)
+        transitions = cls(transition_counts.shape[0], transition_counts.shape[1])
+        states, actions, new_states = np.nonzero(transition_counts)
+        transitions.add_many(states, actions, new_states, transition_counts[states, actions, new_states])
+        transitions.compact()
+        return transitions
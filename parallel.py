@@ -0,0 +1,224 @@
+"""Train the AI agent on several games in parallel.
+
+Authors:
+    Gael Colas
+
+Remarks:
+    K worker processes each drive their own game (Chrome WebDriver session or headless simulator).
+    They stream the transitions they observe to a single aggregator owning the approximate MDP.
+    The aggregator re-solves the MDP and broadcasts the updated greedy policy back to the workers.
+"""
+
+import argparse
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+
+from args import get_game_args
+from dino import Dino
+from agent import AIAgent
+from translog import TransitionLogger
+from util import load_agent, CheckpointWriter
+
+
+def run_worker(args, worker_id, policy, policy_version, eps, transitions_queue, stop_event):
+    """Play games continuously and send the transitions observed in each simulation to the aggregator.
+
+    Args:
+        'args' (ArgumentParser): parser gethering all the Game parameters
+        'worker_id' (int): index of the worker
+        'policy' (mp.Array of int8, [num_states]): greedy policy broadcast by the aggregator
+        'policy_version' (mp.Value of int): number of times the policy has been broadcast
+        'eps' (mp.Value of float): epsilon-greedy coefficient broadcast by the aggregator
+        'transitions_queue' (mp.Queue): queue of the simulations sent to the aggregator
+        'stop_event' (mp.Event): set by the aggregator to stop the worker
+
+    Remarks:
+        The worker records the transitions in the approximate MDP of a local agent, which is never solved.
+        At the end of each simulation, the aggregated counts are sent and the local MDP is cleared.
+    """
+    # the random state is copied from the parent process: draw a new one
+    if args.seed is None:
+        np.random.seed()
+    else:
+        # each worker plays its own seeded obstacles
+        args = argparse.Namespace(**vars(args))
+        args.seed += worker_id
+        np.random.seed(args.seed)
+
+    dino = Dino(args)
+    agent = AIAgent(args, dino)
+    # one transition log per worker
+    if args.transition_log:
+        agent.transition_logger = TransitionLogger("{}.{}".format(args.transition_log, worker_id))
+    local_version = -1
+
+    while not stop_event.is_set():
+        # use the last broadcast policy
+        if policy_version.value != local_version:
+            with policy.get_lock():
+                local_version = policy_version.value
+                agent.policy = np.frombuffer(policy.get_obj(), dtype=np.int8).tolist()
+        agent.eps = eps.value
+
+        # play a simulation
+        while not dino.is_crashed():
+            agent.choose_action()
+            agent.set_transition()
+        # record the last transition
+        agent.set_transition()
+        agent.flush_episode()
+        if agent.transition_logger:
+            agent.transition_logger.flush()
+        score = dino.get_score()
+
+        # send the counts observed during the simulation
+        transitions = agent.mdp_data['transition_counts']
+        transitions.compact()
+        reward_counts = agent.mdp_data['reward_counts']
+        visited_states = np.flatnonzero(reward_counts[:, 1])
+        transitions_queue.put((worker_id, score, transitions.rows, transitions.cols, transitions.counts,
+                               visited_states, reward_counts[visited_states]))
+
+        # clear the local MDP (the cached policy is kept) and start a new simulation
+        agent.initialize_mdp_data()
+        dino.start()
+        agent.state = dino.get_state()
+
+    if agent.transition_logger:
+        agent.transition_logger.close()
+    dino.quit()
+
+
+class Aggregator:
+    """'Aggregator' class: train the AI agent with the transitions collected by parallel workers.
+
+    Attributes:
+        'args' (ArgumentParser): parser gethering all the Game parameters
+        'n_workers' (int): number of worker processes K
+        'agent' (AIAgent): AI agent owning the approximate MDP, without Dino controller
+        'checkpoint_writer' (CheckpointWriter): saves the agent parameters in the background
+
+        'policy' (mp.Array of int8, [num_states]): greedy policy shared with the workers
+        'policy_version' (mp.Value of int): number of times the policy has been broadcast
+        'eps' (mp.Value of float): epsilon-greedy coefficient shared with the workers
+        'transitions_queue' (mp.Queue): queue of the simulations sent by the workers
+        'stop_event' (mp.Event): stops the workers
+        'workers' (list of mp.Process): worker processes
+
+        'n_sim' (int): number of simulations received
+        'n_steps' (int): number of transitions received
+        'highscore' (int): best score achieved by the workers
+    """
+    def __init__(self, args, n_workers):
+        self.args = args
+        self.n_workers = n_workers
+
+        self.agent = AIAgent(args, None)
+        # load saved parameters
+        if args.load_save:
+            load_agent(self.agent, args.save_filename)
+        self.checkpoint_writer = CheckpointWriter()
+
+        # state shared with the workers
+        self.policy = mp.Array('b', self.agent.mdp_data['num_states'])
+        self.policy_version = mp.Value('i', 0)
+        self.eps = mp.Value('d', self.agent.eps)
+        self.transitions_queue = mp.Queue()
+        self.stop_event = mp.Event()
+        self.broadcast()
+
+        self.workers = [mp.Process(target=run_worker, daemon=True,
+                                   args=(args, worker_id, self.policy, self.policy_version, self.eps,
+                                         self.transitions_queue, self.stop_event))
+                        for worker_id in range(n_workers)]
+
+        self.n_sim = 0
+        self.n_steps = 0
+        self.highscore = 0
+
+    def broadcast(self):
+        """Send the greedy policy and the epsilon-greedy coefficient of the agent to the workers.
+        """
+        with self.policy.get_lock():
+            np.frombuffer(self.policy.get_obj(), dtype=np.int8)[:] = self.agent.get_policy()
+            self.policy_version.value += 1
+        self.eps.value = self.agent.eps
+
+    def record(self, simulation):
+        """Record the transitions of a simulation sent by a worker.
+
+        Args:
+            'simulation' (tuple): message of 'run_worker'
+        """
+        _, score, rows, cols, counts, visited_states, reward_counts = simulation
+        transitions = self.agent.mdp_data['transition_counts']
+
+        # update the transition and the reward counts
+        transitions.add_many(rows // transitions.num_actions, rows % transitions.num_actions, cols, counts)
+        self.agent.mdp_data['reward_counts'][visited_states] += reward_counts
+
+        # make the algorithm more greedy after each simulation
+        self.agent.eps += 0.01
+
+        self.n_sim += 1
+        self.n_steps += int(np.sum(counts))
+        self.highscore = max(self.highscore, score)
+
+    def train(self):
+        """Collect the simulations of the workers continuously.
+        Re-solve the approximate MDP every time each worker has sent one simulation on average.
+        """
+        for worker in self.workers:
+            worker.start()
+
+        try:
+            start_time = time.time()
+            scores = []
+            while True:
+                try:
+                    simulation = self.transitions_queue.get(timeout=1.)
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in self.workers):
+                        raise RuntimeError("All the workers have stopped.")
+                    continue
+                self.record(simulation)
+                scores.append(simulation[1])
+
+                if len(scores) < self.n_workers:
+                    continue
+
+                # update the approximate MDP and broadcast the new policy
+                self.agent.update_mdp_parameters()
+                self.broadcast()
+
+                # periodic autosave
+                if self.args.autosave_every > 0 and self.n_sim % self.args.autosave_every < len(scores):
+                    self.checkpoint_writer.save(self.agent, self.args.save_filename)
+
+                elapsed_time = time.time() - start_time
+                print("Simulations: {}, mean score {:.1f}, highscore {}, {:.0f} steps/s".format(
+                    self.n_sim, np.mean(scores), self.highscore, self.n_steps / elapsed_time))
+                print("Solver {solver}: {iterations} iterations, residual {residual:.4f}, {time:.3f} s".format(**self.agent.solve_stats))
+                scores = []
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop the workers and wait for the pending checkpoint.
+        """
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout=5.)
+            if worker.is_alive():
+                worker.terminate()
+        self.checkpoint_writer.wait()
+
+
+if __name__ == '__main__':
+    # get arguments needed to play the Game
+    args = get_game_args()
+    # train with parallel workers until interrupted
+    Aggregator(args, args.n_workers).train()
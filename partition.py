@@ -0,0 +1,427 @@
+"""Adaptive variable-resolution partition of the state space of the Dino.
+
+Authors:
+    Gael Colas
+"""
+
+import numpy as np
+
+from agent import AIAgent, PTERODACTYL_HEIGHTS
+from mdp import UniformGrid, SparseTransitions, PTERODACTYL_TYPE
+
+# maximum number of continuous samples kept in each cell, and among them of samples leading to a crash
+MAX_SAMPLES = 256
+MAX_CRASH_SAMPLES = 64
+# columns of the samples
+DT, Y, ACTION, TARGET, CRASHED = range(5)
+
+
+def target_variance(samples):
+    """Variance of the Bellman targets of the samples of a cell, within each action.
+
+    Args:
+        'samples' (np.array, [n, 5]): samples (dt, y, action, target, crashed)
+
+    Return:
+        'variance' (float): 0 if each action always leads to the same target
+    """
+    variance = 0.
+    for action in (0, 1):
+        targets = samples[samples[:, ACTION] == action, TARGET]
+        if targets.size:
+            variance += targets.size * targets.var()
+    return variance / max(len(samples), 1)
+
+
+class AdaptivePartition:
+    """kd-tree partition of the (dt, y) plane for each obstacle level, refined where the outcomes of the transitions conflict.
+    Same interface as 'mdp.StateBinning': the leaves of the trees are the discretized states.
+
+    Attributes:
+        'max_dt', 'max_y' (float): upper bounds of dt and y: the root cells cover [0, max_dt] x [0, max_y]
+        'split_samples' (int): minimum number of samples of a cell before it can split
+        'initial_depth' (int): depth of the initial trees: each obstacle level starts as a coarse grid of 2^initial_depth cells
+        'max_depth' (int): maximum depth of the trees
+        'min_gain' (float): minimum relative reduction of the variance of the targets for a cell to split
+        'level_grid' (UniformGrid): discretization of the pterodactyl flight levels
+        'n_levels' (int): number of obstacle levels: one per pterodactyl flight level, and one for the ground obstacles
+
+        'split_dim' (list of int): dimension split by each node (0: dt, 1: y), -1 for a leaf
+        'split_value' (list of float): threshold of each node: the left child holds the values below
+        'left' (list of int): left child of each node, the right child is 'left + 1'
+        'state' (list of int): discretized state of each leaf
+        'depth' (list of int): depth of each node
+        'lower', 'upper' (list of np.array, [2]): bounds of the cell of each node
+        'roots' (list of int): root node of each obstacle level
+        'state_node' (list of int): leaf node of each discretized state, -1 for the FAIL and NO_OBSTACLE states
+        'num_states' (int): number of discretized states
+
+        'samples' (dict of np.array, [n, 5]): continuous samples (dt, y, action, target, crashed) of each leaf
+        'pending' (list of tuple): buffered batches of samples (state indices, samples), added to the leaves at the next refinement
+        'rng' (np.random.RandomState): random generator of the sample subsets
+
+    Remarks:
+        State 0 is a FAIL state ; State 1 is a NO_OBSTACLE state.
+        The target of a sample is the Bellman target 'reward + gamma*V(new_state)' observed when it was recorded:
+        a cell splits when its targets conflict, i.e. when the same action leads to new states of different values.
+        When a leaf splits, its left child keeps its state and its right child gets a new state: the existing state indices are stable.
+        The children of a split are refined in the same pass: a cell holding many conflicting samples splits several times at once.
+    """
+    def __init__(self, max_dt, max_y, split_samples=64, initial_depth=4, max_depth=10, min_gain=0.1):
+        self.max_dt = float(max_dt)
+        self.max_y = float(max_y)
+        self.split_samples = split_samples
+        self.initial_depth = initial_depth
+        self.max_depth = max_depth
+        self.min_gain = min_gain
+        self.level_grid = UniformGrid(PTERODACTYL_HEIGHTS)
+        self.n_levels = len(PTERODACTYL_HEIGHTS) + 1
+
+        self.split_dim, self.split_value, self.left, self.state, self.depth = [], [], [], [], []
+        self.lower, self.upper = [], []
+        self.state_node = [-1, -1]
+        self.num_states = 2
+        self.samples = {}
+        self.pending = []
+        self.rng = np.random.RandomState()
+        self._arrays = None
+
+        # one tree per obstacle level, starting as a coarse grid: the cells are halved along dt and y in turn
+        self.roots = [self._add_leaf(np.zeros(2), np.array([self.max_dt, self.max_y]), 0, self._new_state())
+                      for _ in range(self.n_levels)]
+        leaves = list(self.roots)
+        for depth in range(min(initial_depth, max_depth)):
+            dim = depth % 2
+            leaves = [child for node in leaves
+                      for child in self._split_leaf(node, dim, (self.lower[node][dim] + self.upper[node][dim]) / 2)]
+
+    def _new_state(self):
+        """Allocate a new discretized state.
+        """
+        self.num_states += 1
+        self.state_node.append(-1)
+        return self.num_states - 1
+
+    def _add_leaf(self, lower, upper, depth, state):
+        """Add a leaf node, return its index.
+        """
+        node = len(self.split_dim)
+        self.split_dim.append(-1)
+        self.split_value.append(0.)
+        self.left.append(-1)
+        self.state.append(state)
+        self.depth.append(depth)
+        self.lower.append(lower)
+        self.upper.append(upper)
+        self.state_node[state] = node
+        self.samples[node] = np.zeros((0, 5))
+        return node
+
+    def _split_leaf(self, node, dim, value):
+        """Split a leaf node in two along a dimension, return its children.
+        The left child keeps the state of the node and the values below the threshold, the right child gets a new state.
+        """
+        left_upper, right_lower = self.upper[node].copy(), self.lower[node].copy()
+        left_upper[dim] = right_lower[dim] = value
+        left = self._add_leaf(self.lower[node], left_upper, self.depth[node] + 1, self.state[node])
+        right = self._add_leaf(right_lower, self.upper[node], self.depth[node] + 1, self._new_state())
+        self.split_dim[node], self.split_value[node], self.left[node] = dim, value, left
+
+        # share the samples between the children
+        samples = self.samples.pop(node)
+        below = samples[:, dim] < value
+        self.samples[left], self.samples[right] = samples[below], samples[~below]
+        self._arrays = None
+
+        return left, right
+
+    def get_arrays(self):
+        """Get the tree as NumPy arrays for the vectorized lookups, cached until the next split.
+        """
+        if self._arrays is None:
+            self._arrays = (np.array(self.split_dim), np.array(self.split_value), np.array(self.left), np.array(self.state))
+        return self._arrays
+
+    def index(self, state, isFail=False):
+        """Get the index of the discretized state containing a state.
+
+        Args:
+            'state' (dict): the current state of the Dino
+            'isFail' (bool): whether the Game is failed
+
+        Return:
+            'ind' (int): index of the discretized state
+        """
+        if not state: # no obstacle created yet
+            return 1
+        if isFail:
+            return 0
+
+        if state['type'] == "PTERODACTYL":
+            node = self.roots[self.level_grid.closest(state['config'])]
+        else:
+            node = self.roots[-1]
+        x = (state['dt'], state['y'])
+
+        # descend the tree
+        split_dim, split_value, left = self.split_dim, self.split_value, self.left
+        while split_dim[node] >= 0:
+            node = left[node] + (x[split_dim[node]] >= split_value[node])
+
+        return self.state[node]
+
+    def indices(self, states, isFail=None):
+        """Vectorized version of 'index'.
+
+        Args:
+            'states' (dict of np.array): states of the Dino, with the obstacle 'type' given by its code in 'agent.OBSTACLE_TYPES' (-1 if no obstacle)
+            'isFail' (np.array of bool, default=None): whether the Game is failed in each state
+
+        Return:
+            'ind' (np.array of int): indices of the discretized states
+        """
+        split_dim, split_value, left, leaf_state = self.get_arrays()
+        obs_type = np.asarray(states['type'])
+        x = np.stack([np.asarray(states['dt'], dtype=float), np.asarray(states['y'], dtype=float)], axis=-1)
+
+        # root of the obstacle level of each state
+        level = np.where(obs_type == PTERODACTYL_TYPE, self.level_grid.closest_many(states['config']), self.n_levels - 1)
+        node = np.array(self.roots)[level]
+
+        # descend the trees, one level at a time
+        rows = np.arange(node.size)
+        inner = split_dim[node] >= 0
+        while inner.any():
+            dims = split_dim[node[inner]]
+            node[inner] = left[node[inner]] + (x[rows[inner], dims] >= split_value[node[inner]])
+            inner = split_dim[node] >= 0
+
+        ind = leaf_state[node]
+        if isFail is not None:
+            ind[np.asarray(isFail, dtype=bool)] = 0
+        # no obstacle created yet
+        ind[obs_type < 0] = 1
+
+        return ind
+
+    def record_many(self, state_indices, dt, y, actions, targets, isCrashed):
+        """Record the continuous samples of a batch of transitions.
+
+        Args:
+            'state_indices' (np.array of int): indices of the discretized states of the transitions
+            'dt', 'y' (np.array of float): continuous states of the transitions
+            'actions' (np.array of int): actions performed
+            'targets' (np.array of float): Bellman targets of the transitions
+            'isCrashed' (np.array of bool): whether each transition led to a crash
+
+        Remarks:
+            The samples are buffered: they are only added to the leaves by the next call to 'merge_samples'.
+        """
+        state_indices = np.asarray(state_indices)
+        valid = state_indices >= 2
+        self.pending.append((state_indices[valid], np.stack([dt, y, actions, targets, isCrashed], axis=-1).astype(float)[valid]))
+
+    def merge_samples(self):
+        """Add the buffered samples to the leaves of their states.
+
+        Remarks:
+            Each leaf keeps a random subset of at most MAX_SAMPLES samples, renewed as new samples arrive.
+            The rare samples leading to a crash are kept in priority.
+        """
+        if not self.pending:
+            return
+        state_indices = np.concatenate([batch[0] for batch in self.pending])
+        new_samples = np.concatenate([batch[1] for batch in self.pending])
+        self.pending = []
+
+        # group the samples by state, in the order they were recorded
+        order = np.argsort(state_indices, kind='stable')
+        states, starts = np.unique(state_indices[order], return_index=True)
+        for state_idx, group in zip(states, np.split(order, starts[1:])):
+            node = self.state_node[state_idx]
+            samples = np.concatenate([self.samples[node], new_samples[group]])
+            # keep a random subset, with the last samples leading to a crash
+            if len(samples) > MAX_SAMPLES:
+                crashed = np.flatnonzero(samples[:, CRASHED])[-MAX_CRASH_SAMPLES:]
+                others = np.flatnonzero(samples[:, CRASHED] == 0)
+                others = self.rng.choice(others, min(others.size, MAX_SAMPLES - crashed.size), replace=False)
+                samples = samples[np.sort(np.concatenate([crashed, others]))]
+            self.samples[node] = samples
+
+    def best_split(self, node):
+        """Find the split of a leaf reducing the most the variance of the targets of its samples.
+
+        Args:
+            'node' (int): leaf node
+
+        Return:
+            'split' (tuple, (dim, value, fraction)): split dimension and threshold, and fraction of the cell below it ; None if no split reduces the variance enough
+        """
+        samples = self.samples[node]
+        variance = target_variance(samples)
+        if variance == 0:
+            return None
+
+        best_split, best_gain = None, self.min_gain
+        for dim in (DT, Y):
+            values = np.sort(samples[:, dim])
+            # threshold between two distinct values, closest to the median
+            gaps = np.flatnonzero(np.diff(values) > 0)
+            if gaps.size == 0:
+                continue
+            gap = gaps[np.argmin(np.abs(gaps - (values.size // 2 - 1)))]
+            value = (values[gap] + values[gap + 1]) / 2
+
+            below = samples[:, dim] < value
+            children_variance = (below.sum()*target_variance(samples[below]) + (~below).sum()*target_variance(samples[~below])) / len(samples)
+            gain = 1 - children_variance / variance
+            if gain > best_gain:
+                # the crash samples are over-represented: the fraction of the cell is estimated without them
+                not_crashed = samples[:, CRASHED] == 0
+                fraction = below[not_crashed].mean() if not_crashed.any() else below.mean()
+                best_split, best_gain = (dim, value, fraction), gain
+
+        return best_split
+
+    def refine(self):
+        """Split the leaves holding enough conflicting samples.
+
+        Return:
+            'splits' (list of tuple, (state, new_state, fraction)): split states, new states and fraction of the split cells kept by the split states
+        """
+        self.merge_samples()
+
+        splits = []
+        # the children added by the splits are visited too
+        node = 0
+        while node < len(self.split_dim):
+            if self.split_dim[node] < 0 and len(self.samples[node]) >= self.split_samples and self.depth[node] < self.max_depth:
+                split = self.best_split(node)
+                if split is not None:
+                    dim, value, fraction = split
+                    left, right = self._split_leaf(node, dim, value)
+                    splits.append((self.state[left], self.state[right], fraction))
+            node += 1
+
+        return splits
+
+    def to_arrays(self):
+        """Convert the trees to a list of arrays, to be saved with the agent parameters.
+        """
+        return [np.array(self.split_dim), np.array(self.split_value), np.array(self.left), np.array(self.state),
+                np.array(self.depth), np.array(self.lower), np.array(self.upper), np.array(self.roots)]
+
+    @classmethod
+    def from_arrays(cls, arrays, split_samples=64, max_depth=10, min_gain=0.1):
+        """Create the partition from the arrays created by 'to_arrays'.
+
+        Remarks:
+            The samples are not saved: the leaves start empty.
+        """
+        split_dim, split_value, left, state, depth, lower, upper, roots = arrays
+        partition = cls(upper[roots[0]][0], upper[roots[0]][1], split_samples, 0, max_depth, min_gain)
+
+        partition.split_dim, partition.split_value = split_dim.tolist(), split_value.tolist()
+        partition.left, partition.state, partition.depth = left.tolist(), state.tolist(), depth.tolist()
+        partition.lower, partition.upper = list(np.array(lower)), list(np.array(upper))
+        partition.roots = roots.tolist()
+
+        leaves = np.flatnonzero(split_dim < 0)
+        partition.num_states = int(state[leaves].max()) + 1
+        partition.state_node = [-1] * partition.num_states
+        for node in leaves:
+            partition.state_node[state[node]] = node
+        partition.samples = {node: np.zeros((0, 5)) for node in leaves}
+
+        return partition
+
+
+class AdaptiveAgent(AIAgent):
+    """AI agent solving an approximate MDP over an adaptive partition of the state space.
+    The partition starts with a coarse grid per obstacle level, and the cells split where the transitions conflict.
+
+    Attributes:
+        'binning' (AdaptivePartition): mapping from the states of the Dino to the discretized states
+
+    Remarks:
+        When a state splits, its transitions and reward counts are shared with the new state in proportion of the samples on each side.
+        The new state starts with the reward and value of the split state.
+    """
+    def initialize_mdp_data(self):
+        """Save a attributes 'mdp_data' that contains all the parameters defining the approximate MDP.
+
+        Parameters:
+            'num_states' (int): the number of discretized states, growing with the partition.
+            'partition' (list of np.array): trees of the partition, see 'AdaptivePartition.to_arrays'
+        """
+        self.binning = AdaptivePartition(self.args.max_dt, self.args.max_y, self.args.split_samples, self.args.initial_depth, self.args.max_depth)
+        num_states = self.binning.num_states
+
+        self.mdp_data = {
+            'num_states': num_states,
+            'partition': self.binning.to_arrays(),
+            'transition_counts': SparseTransitions(num_states, 2),
+            'reward_counts': np.zeros((num_states, 2)),
+            'reward': np.zeros(num_states),
+            'value': np.zeros(num_states)
+        }
+
+    def set_mdp_data(self, mdp_data):
+        """Replace the approximate MDP parameters, for instance with loaded ones.
+        """
+        self.mdp_data = mdp_data
+        self.binning = AdaptivePartition.from_arrays(mdp_data['partition'], self.args.split_samples, self.args.max_depth)
+        self.invalidate_policy()
+
+    def update_mdp_counts_batch(self, states, actions, new_states, isCrashed):
+        """Update the transition and reward counts of a batch of transitions, and record their continuous samples.
+        """
+        super().update_mdp_counts_batch(states, actions, new_states, isCrashed)
+
+        # Bellman targets of the transitions
+        hasObstacles = (np.asarray(states['type']) >= 0) & (np.asarray(new_states['type']) >= 0)
+        obsPassed = hasObstacles & (np.asarray(new_states['dx']) > np.asarray(states['dx']))
+        targets = self.get_rewards(isCrashed, obsPassed) + self.gamma*self.mdp_data['value'][self.binning.indices(new_states, isCrashed)]
+
+        self.binning.record_many(self.binning.indices(states), states['dt'], states['y'], actions, targets, isCrashed)
+
+    def update_mdp_estimates(self):
+        """Refine the partition, then update the estimated transition and reward functions.
+
+        Return:
+            'changed_states' (np.array of int): states whose transitions or reward changed, including the split and new states
+        """
+        changed_states = self.refine_partition()
+        return np.union1d(changed_states, super().update_mdp_estimates())
+
+    def refine_partition(self):
+        """Split the conflicting states of the partition and resize the approximate MDP.
+
+        Return:
+            'changed_states' (np.array of int): states observed since the last update, split states and new states
+        """
+        transitions = self.mdp_data['transition_counts']
+        changed_states = [transitions.compact() // transitions.num_actions]
+
+        splits = self.binning.refine()
+        if not splits:
+            return changed_states[0]
+
+        for state, new_state, fraction in splits:
+            transitions.split_state(state, fraction)
+
+            # the new state starts with the reward and value of the split state
+            reward_counts = self.mdp_data['reward_counts']
+            self.mdp_data['reward_counts'] = np.vstack([reward_counts, (1 - fraction)*reward_counts[state]])
+            self.mdp_data['reward_counts'][state] *= fraction
+            self.mdp_data['reward'] = np.append(self.mdp_data['reward'], self.mdp_data['reward'][state])
+            self.mdp_data['value'] = np.append(self.mdp_data['value'], self.mdp_data['value'][state])
+            changed_states.append([state, new_state])
+
+        self.mdp_data['num_states'] = self.binning.num_states
+        self.mdp_data['partition'] = self.binning.to_arrays()
+
+        # the policy must cover the new states until the next solve
+        self.update_policy()
+
+        return np.unique(np.concatenate(changed_states))
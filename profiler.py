@@ -0,0 +1,177 @@
+"""Opt-in latency instrumentation of the control loop.
+
+Authors:
+    Gael Colas
+
+Remarks:
+    The methods of the game, of the Dino controller and of the agent are wrapped on the instances: nothing is timed when profiling is off.
+    The durations are kept in fixed-size log-scale histograms, and a window of steps can be exported as a Chrome trace-event timeline (chrome://tracing).
+"""
+
+import functools
+import math
+import time
+
+import ujson as json
+
+# methods timed on each object
+GAME_METHODS = ('snapshot', 'advance', 'send_action', 'press_up', 'press_down', 'set_duck', 'wait', 'restart', 'resume', 'wait_events')
+DINO_METHODS = ('act', 'refresh', 'start', 'wait_events')
+AGENT_METHODS = ('choose_action', 'set_transition', 'flush_episode', 'reset', 'update_mdp_parameters', 'update_policy', 'wait_mdp_update', 'apply_solution')
+
+# histogram range (in s) and resolution
+MIN_DURATION = 1e-7
+N_DECADES = 10
+BUCKETS_PER_DECADE = 20
+
+
+class Histogram:
+    """Log-scale histogram of durations.
+
+    Attributes:
+        'buckets' (list of int): number of durations in each bucket, bucket i covers [10^(i/BUCKETS_PER_DECADE), 10^((i+1)/BUCKETS_PER_DECADE)) * MIN_DURATION
+        'count' (int): number of durations
+        'total' (float): sum of the durations (in s)
+        'max' (float): longest duration (in s)
+
+    Remarks:
+        The percentiles are estimated with a relative error below 6%.
+    """
+    def __init__(self):
+        self.buckets = [0] * (N_DECADES * BUCKETS_PER_DECADE)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, duration):
+        """Record a duration (in s).
+        """
+        if duration > MIN_DURATION:
+            i = min(int(math.log10(duration / MIN_DURATION) * BUCKETS_PER_DECADE), len(self.buckets) - 1)
+        else:
+            i = 0
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def percentile(self, q):
+        """Estimate a percentile of the durations.
+
+        Args:
+            'q' (float): percentile in [0, 100]
+
+        Return:
+            'duration' (float): estimated percentile (in s), geometric center of its bucket
+        """
+        rank = q / 100. * self.count
+        cumulated = 0
+        for i, bucket_count in enumerate(self.buckets):
+            cumulated += bucket_count
+            if bucket_count and cumulated >= rank:
+                return min(MIN_DURATION * 10**((i + 0.5) / BUCKETS_PER_DECADE), self.max)
+        return self.max
+
+
+class Profiler:
+    """Time the calls of instrumented methods.
+
+    Attributes:
+        'histograms' (dict of Histogram): duration histogram of each timed name
+        'step' (int): number of control steps since the start of the profiling
+        'trace_start' (int): first traced step
+        'trace_steps' (int): number of traced steps, 0 to disable the trace
+        'trace_filename' (str): name of the Chrome trace-event JSON file
+        'trace_events' (list of dict): trace events of the traced steps
+        'origin' (float): time origin of the trace (perf_counter, in s)
+    """
+    def __init__(self, trace_filename="trace.json", trace_start=0, trace_steps=0):
+        self.histograms = {}
+        self.step = 0
+        self.trace_start = trace_start
+        self.trace_steps = trace_steps
+        self.trace_filename = trace_filename
+        self.trace_events = []
+        self.origin = time.perf_counter()
+
+    def is_tracing(self):
+        """Check if the current step is in the traced window.
+        """
+        return self.trace_start <= self.step < self.trace_start + self.trace_steps
+
+    def record(self, name, start, end):
+        """Record a timed call.
+
+        Args:
+            'name' (str): name of the timed call
+            'start', 'end' (float): start and end times of the call (perf_counter, in s)
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(end - start)
+
+        if self.is_tracing():
+            # complete event, timestamps in us
+            self.trace_events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                      'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6})
+
+    def timed(self, name, function):
+        """Wrap a function to time its calls.
+
+        Args:
+            'name' (str): name of the timed call
+            'function' (callable): function to time
+
+        Return:
+            'timed_function' (callable): function recording its duration under 'name'
+        """
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter())
+        return timed_function
+
+    def instrument(self, obj, method_names, prefix):
+        """Time the calls of methods of an object, by replacing them on the instance.
+
+        Args:
+            'obj' (object): object to instrument
+            'method_names' (tuple of str): names of the methods to time, missing methods are skipped
+            'prefix' (str): prefix of the timed names
+        """
+        for method_name in method_names:
+            if hasattr(obj, method_name):
+                setattr(obj, method_name, self.timed(prefix + method_name, getattr(obj, method_name)))
+
+    def next_step(self):
+        """Mark the end of a control step, write the trace at the end of the traced window.
+        """
+        self.step += 1
+        if self.trace_steps and self.step == self.trace_start + self.trace_steps:
+            self.write_trace()
+
+    def write_trace(self):
+        """Write the trace events to a Chrome trace-event JSON file.
+        """
+        with open(self.trace_filename, "w") as trace_file:
+            json.dump({'traceEvents': self.trace_events, 'displayTimeUnit': 'ms'}, trace_file)
+        print("The trace of steps {} to {} has been saved to: {}".format(self.trace_start, self.step, self.trace_filename))
+        self.trace_events = []
+
+    def summary(self):
+        """Summarize the timed calls.
+
+        Return:
+            'summary_text' (str): table of the count and latency percentiles of each timed name (in ms)
+        """
+        lines = ["{:<32}{:>10}{:>10}{:>10}{:>10}{:>10}".format("Latency (ms)", "count", "p50", "p95", "p99", "max")]
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            lines.append("{:<32}{:>10}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}".format(
+                name, histogram.count, 1e3 * histogram.percentile(50), 1e3 * histogram.percentile(95),
+                1e3 * histogram.percentile(99), 1e3 * histogram.max))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,53 @@
+"""AI agent learning a tabular action-value function online.
+
+Authors:
+    Gael Colas
+"""
+
+import numpy as np
+
+from td_agent import OnlineTDAgent
+
+
+class QLearningAgent(OnlineTDAgent):
+    """AI agent controlling the Dino with a tabular action-value function on the discretized states of 'AIAgent'.
+    The agent is trained online by Q-learning: each transition updates the action-value of the previous (state, action) pair.
+
+    Acting and learning cost O(1) per time step: there is no model to estimate, and nothing to solve at the end of a simulation.
+
+    Attributes:
+        'mdp_data' (dict): parameters of the agent: 'num_states', 'state_discretization' and 'q_values' (np.array, [num_states, 2])
+
+    Remarks:
+        The online learning is the one of 'OnlineTDAgent'.
+    """
+    def initialize_mdp_data(self):
+        """Save a attributes 'mdp_data' that contains the parameters of the agent.
+
+        Parameters:
+            'num_states' (int): the number of discretized states, see 'AIAgent.initialize_mdp_data'
+
+        Initialization scheme:
+            - Action-values initialized to 0
+        """
+        # same discretization as the model-based agent
+        super().initialize_mdp_data()
+
+        self.mdp_data = {
+            'num_states': self.mdp_data['num_states'],
+            'state_discretization': self.mdp_data['state_discretization'],
+            'q_values': np.zeros((self.mdp_data['num_states'], 2))
+        }
+
+    def get_q_values(self, state):
+        """Get the action-values of a state: the row of its discretized state.
+        """
+        return self.mdp_data['q_values'][self.get_closest_state_idx(state)]
+
+    def update_q_values(self, state, action, new_state, reward, isCrashed):
+        """Q-learning update of the action-value of the previous (state, action) pair, see 'OnlineTDAgent.update_q_values'.
+        """
+        q_values = self.mdp_data['q_values']
+        s = self.get_closest_state_idx(state)
+
+        q_values[s, action] += self.alpha * (self.get_td_target(new_state, reward, isCrashed) - q_values[s, action])
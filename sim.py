@@ -0,0 +1,628 @@
+"""Headless simulation of the Chrome Dino Runner.
+
+Authors:
+    Gael Colas
+
+Remarks:
+    The physics are a Python port of the Runner, Trex, Horizon and Obstacle classes of the Chromium game.
+    Simulated time is advanced frame by frame instead of waiting on the wall clock.
+"""
+
+import numpy as np
+
+from args import get_game_args
+
+# frame rate of the game
+FPS = 60
+MS_PER_FRAME = 1000. / FPS
+
+# dimensions of the game canvas
+WIDTH = 600
+HEIGHT = 150
+BOTTOM_PAD = 10
+
+# Runner configuration
+GAP_COEFFICIENT = 0.6
+MAX_GAP_COEFFICIENT = 1.5
+MAX_OBSTACLE_LENGTH = 3
+MAX_OBSTACLE_DUPLICATION = 2
+DISTANCE_COEFFICIENT = 0.025
+
+# Trex configuration
+TREX_CONFIG = {
+    'DROP_VELOCITY': -5,
+    'GRAVITY': 0.6,
+    'HEIGHT': 47,
+    'INITIAL_JUMP_VELOCITY': -10,
+    'MAX_JUMP_HEIGHT': 30,
+    'MIN_JUMP_HEIGHT': 30,
+    'SPEED_DROP_COEFFICIENT': 3,
+    'START_X_POS': 50,
+    'WIDTH': 44
+}
+TREX_GROUND_Y_POS = HEIGHT - TREX_CONFIG['HEIGHT'] - BOTTOM_PAD
+TREX_MIN_JUMP_Y_POS = TREX_GROUND_Y_POS - TREX_CONFIG['MIN_JUMP_HEIGHT']
+
+# Trex collision boxes (x, y, width, height)
+TREX_COLLISION_BOXES = {
+    'DUCKING': [(1, 18, 55, 25)],
+    'RUNNING': [(22, 0, 17, 16), (1, 18, 30, 9), (10, 35, 14, 8), (1, 24, 29, 5), (5, 30, 21, 4), (9, 34, 15, 4)]
+}
+
+# Obstacle configurations, in the order of the game 'Obstacle.types'
+OBSTACLE_CONFIGS = [
+    {
+        'type': 'CACTUS_SMALL',
+        'width': 17,
+        'height': 35,
+        'yPos': [105],
+        'multipleSpeed': 4,
+        'minGap': 120,
+        'minSpeed': 0,
+        'speedOffset': 0,
+        'collisionBoxes': [(0, 7, 5, 27), (4, 0, 6, 34), (10, 4, 7, 14)]
+    },
+    {
+        'type': 'CACTUS_LARGE',
+        'width': 25,
+        'height': 50,
+        'yPos': [90],
+        'multipleSpeed': 7,
+        'minGap': 120,
+        'minSpeed': 0,
+        'speedOffset': 0,
+        'collisionBoxes': [(0, 12, 7, 38), (8, 0, 7, 49), (13, 10, 10, 38)]
+    },
+    {
+        'type': 'PTERODACTYL',
+        'width': 46,
+        'height': 40,
+        'yPos': [100, 75, 50],
+        'multipleSpeed': 999,
+        'minGap': 150,
+        'minSpeed': 8.5,
+        'speedOffset': 0.8,
+        'collisionBoxes': [(15, 15, 16, 5), (18, 21, 24, 6), (2, 14, 4, 3), (6, 10, 4, 7), (10, 8, 6, 9)]
+    }
+]
+
+
+def box_compare(box_a, box_b):
+    """Check whether two collision boxes (x, y, width, height) overlap.
+    """
+    return (box_a[0] < box_b[0] + box_b[2] and box_a[0] + box_a[2] > box_b[0] and
+            box_a[1] < box_b[1] + box_b[3] and box_a[1] + box_a[3] > box_b[1])
+
+
+class SimObstacle:
+    """Obstacle of the simulated game.
+
+    Attributes:
+        'typeConfig' (dict): configuration of the obstacle type, from 'OBSTACLE_CONFIGS'
+        'size' (int): number of consecutive obstacles (only for cactuses)
+        'width' (int): pixel width of the obstacle
+        'xPos', 'yPos' (float): pixel position of the obstacle
+        'gap' (int): pixel gap before the next obstacle can be generated
+        'collisionBoxes' (list of tuple): collision boxes relative to the obstacle position
+    """
+    def __init__(self, typeConfig, size, speed, rng):
+        self.typeConfig = typeConfig
+
+        # multiple obstacles only allowed above a given speed
+        if size > 1 and typeConfig['multipleSpeed'] > speed:
+            size = 1
+        self.size = size
+        self.width = typeConfig['width'] * size
+
+        # flight level (for pterodactyls)
+        self.yPos = typeConfig['yPos'][rng.randint(len(typeConfig['yPos']))]
+        self.xPos = WIDTH - self.width
+
+        # stretch the middle collision box for consecutive cactuses
+        self.collisionBoxes = list(typeConfig['collisionBoxes'])
+        if size > 1:
+            box_0, box_1, box_2 = self.collisionBoxes[:3]
+            self.collisionBoxes[1] = (box_1[0], box_1[1], self.width - box_0[2] - box_2[2], box_1[3])
+            self.collisionBoxes[2] = (self.width - box_2[2], box_2[1], box_2[2], box_2[3])
+
+        # pterodactyls fly faster or slower than the ground
+        self.speedOffset = 0
+        if typeConfig['speedOffset']:
+            self.speedOffset = typeConfig['speedOffset'] if rng.rand() > 0.5 else -typeConfig['speedOffset']
+
+        # gap before the next obstacle
+        min_gap = round(self.width * speed + typeConfig['minGap'] * GAP_COEFFICIENT)
+        max_gap = round(min_gap * MAX_GAP_COEFFICIENT)
+        self.gap = rng.randint(min_gap, max_gap + 1)
+
+        self.followingObstacleCreated = False
+
+    def update(self, deltaTime, speed):
+        """Move the obstacle towards the dino.
+        """
+        speed += self.speedOffset
+        self.xPos -= np.floor(speed * FPS / 1000 * deltaTime)
+
+    def is_visible(self):
+        """Check if the obstacle is still on the canvas.
+        """
+        return self.xPos + self.width > 0
+
+
+class SimGame:
+    """'SimGame' class: headless stand-in for 'Game' simulating the Runner in pure Python.
+
+    Attributes:
+        'config' (dict): simulation parameters of the Runner (SPEED, MAX_SPEED, ACCELERATION, CLEAR_TIME)
+        'rng' (np.random.RandomState): random generator for the obstacles
+        'seed' (int): seed of the obstacles, None if random
+
+        'playing', 'crashed' (bool): whether the game is playing or over
+        'playCount' (int): number of simulations played
+        'events' (list of dict): game events not yet returned by 'wait_events'
+        'currentSpeed' (float): current speed of the dino
+        'runningTime' (float): time elapsed since the start of the simulation (in ms)
+        'distanceRan' (float): pixel distance ran since the start of the simulation
+        'obstacles' (list of SimObstacle): obstacles currently on the canvas
+        'obstacleHistory' (list of str): types of the last generated obstacles
+
+        'status' (str): status of the dino: 'RUNNING', 'JUMPING' or 'DUCKING'
+        'yPos' (float): pixel y position of the dino (top coordinate)
+        'jumpVelocity' (float): vertical velocity of the dino
+    """
+    def __init__(self, args):
+        """Create the simulated game.
+        """
+        self.config = {}
+        self.seed = args.seed
+        # the first simulation has number 1
+        self.rng = self.seeded_rng(1)
+
+        self.playing = False
+        self.crashed = False
+        self.playCount = 0
+        self.events = []
+        # time left over from the last call to 'wait' (in ms)
+        self._time_left = 0.
+
+        # set the simulation parameters
+        self.set_config(args)
+        self._reset_runner()
+
+    def set_config(self, args):
+        """Set the parameters of the simulation.
+
+        Remarks:
+            The settable parameters are: initial and maximum speed of the dino, acceleration of the dino.
+        """
+        self.config['SPEED'] = args.initial_speed
+        self.config['MAX_SPEED'] = args.max_speed
+        self.config['ACCELERATION'] = args.acceleration
+        self.config['CLEAR_TIME'] = args.clear_time
+        self.currentSpeed = args.initial_speed
+
+    def seeded_rng(self, playCount):
+        """Get the random generator of the obstacles of a simulation.
+
+        Args:
+            'playCount' (int): number of the simulation
+
+        Return:
+            'rng' (np.random.RandomState): generator seeded with 'seed' and the number of the simulation, random if there is no seed
+        """
+        if self.seed is None:
+            return np.random.RandomState()
+        return np.random.RandomState([self.seed, playCount])
+
+    def _reset_runner(self):
+        """Reset the Runner, the Horizon and the Trex.
+        """
+        self.currentSpeed = self.config['SPEED']
+        self.runningTime = 0.
+        self.distanceRan = 0.
+        self.obstacles = []
+        self.obstacleHistory = []
+
+        self.status = 'RUNNING'
+        self.xPos = TREX_CONFIG['START_X_POS']
+        self.yPos = TREX_GROUND_Y_POS
+        self.jumpVelocity = 0.
+        self.jumping = False
+        self.ducking = False
+        self.speedDrop = False
+        self.reachedMinHeight = False
+
+    def get_crashed(self):
+        """Check if the agent has crashed on an obstacle.
+
+        Return:
+            'hasCrashed' (bool): True if the agent has crashed
+        """
+        return self.crashed
+
+    def get_playing(self):
+        """Check if the game is playing (ie not paused and not game over).
+
+        Return:
+            'isPlaying' (bool): True if the game is playing (not crashed and not game over)
+        """
+        return self.playing
+
+    def get_score(self):
+        """Get the current score.
+
+        Return:
+            'score' (int): current score
+        """
+        return int(round(self.distanceRan * DISTANCE_COEFFICIENT))
+
+    def get_n_sim(self):
+        """Get the number of simulations played.
+
+        Return:
+            'n_sim' (int): number of simulations played
+        """
+        return self.playCount
+
+    def restart(self):
+        """Restart the game.
+        """
+        self.playCount += 1
+        self.playing = True
+        self.crashed = False
+        self._time_left = 0.
+        if self.seed is not None:
+            self.rng = self.seeded_rng(self.playCount)
+        self._reset_runner()
+        self._add_event('restart')
+
+    def press_up(self):
+        """Press the UP Arrow key.
+
+        Remarks:
+            For the first game: start the game.
+        """
+        if self.crashed:
+            return
+
+        if not self.playing and self.playCount == 0:
+            # first game: the key starts the simulation
+            self.playCount = 1
+            self.playing = True
+
+        if not self.jumping and not self.ducking:
+            self._start_jump()
+
+    def press_down(self):
+        """Press the DOWN Arrow key.
+
+        Remarks:
+            The key is released immediately: the Dino only ducks for one keystroke.
+        """
+        if self.playing:
+            self.set_duck(0.)
+
+    def set_duck(self, duck_time):
+        """Make the Dino duck for the specified amount of time.
+
+        Args:
+            'duck_time' (float): how long (in s) the Dino has to duck
+        """
+        if self.jumping:
+            # if jumping: speed drop
+            self._set_speed_drop()
+        else:
+            # otherwise duck
+            self._set_duck(True)
+            self.wait(duck_time)
+            self._set_duck(False)
+
+    def pause(self):
+        """Pause the game.
+        """
+        self.playing = False
+        self._add_event('stop')
+
+    def resume(self):
+        """Resume the game if the agent has not crashed.
+        """
+        if not self.crashed:
+            self.playing = True
+            self._add_event('play')
+
+    def wait_events(self, timeout):
+        """Wait for game events: game over, restart, pause ('stop') or resume ('play').
+
+        Args:
+            'timeout' (float): maximum waiting time (in s)
+
+        Return:
+            'events' (list of dict): 'type', 'playCount' and 'time' (simulated, in ms) of the events since the last call, empty after the timeout
+
+        Remarks:
+            The simulated game runs until the timeout if there is no event yet.
+        """
+        if not self.events:
+            self.wait(timeout)
+        events, self.events = self.events, []
+        return events
+
+    def _add_event(self, name):
+        """Record a game event, see 'wait_events'.
+        """
+        self.events.append({'type': name, 'playCount': self.playCount, 'time': self.runningTime})
+
+    def end(self):
+        """End the game.
+        """
+        self.playing = False
+
+    def wait(self, duration):
+        """Let the game run for the specified amount of time.
+
+        Args:
+            'duration' (float): how long (in s) the game has to run
+
+        Remarks:
+            The simulated time is advanced frame by frame, the remainder is kept for the next call.
+        """
+        self._time_left += 1000. * duration
+        n_frames = int(self._time_left // MS_PER_FRAME)
+        self._time_left -= n_frames * MS_PER_FRAME
+
+        for _ in range(n_frames):
+            self._update(MS_PER_FRAME)
+
+    def advance(self, n_frames, action=0):
+        """Perform an action and step the game for the specified number of frames.
+
+        Args:
+            'n_frames' (int): number of frames to simulate
+            'action' (int): action to perform: 1 if 'jumping', 2 if 'ducking' during the frames, 0 otherwise
+
+        Return:
+            'snap' (dict): snapshot of the game state after the frames, see 'snapshot'
+        """
+        if action == 1 and not self.jumping and not self.ducking:
+            self._start_jump()
+        elif action == 2:
+            if self.jumping:
+                self._set_speed_drop()
+            else:
+                self._set_duck(True)
+
+        for _ in range(n_frames):
+            self._update(MS_PER_FRAME)
+
+        if action == 2:
+            self._set_duck(False)
+
+        return self.snapshot()
+
+    def get_obstacle(self):
+        """Get the information about the next obstacle.
+
+        Return:
+            'obstacle_info' (dict): dictionary gathering the next obstacle information
+
+        Remarks:
+            Same format as 'Game.get_obstacle'.
+        """
+        if not self.obstacles: # no obstacles have been generated yet
+            return None
+
+        next_obstacle = self.obstacles[0]
+
+        # check if the obstacle has been passed
+        if (len(self.obstacles) > 1) and next_obstacle.xPos < self.xPos:
+            next_obstacle = self.obstacles[1]
+
+        # obstacle information
+        obstacle_info = {'type': next_obstacle.typeConfig['type']}
+
+        if obstacle_info['type'] == 'PTERODACTYL':
+            # flight level
+            obstacle_info['config'] = next_obstacle.yPos
+        else:
+            # number of consecutive cactuses
+            obstacle_info['config'] = next_obstacle.size
+
+        obstacle_info['width'] = next_obstacle.width
+        obstacle_info['dx'] = next_obstacle.xPos
+
+        return obstacle_info
+
+    def snapshot(self):
+        """Get a snapshot of the game state.
+
+        Return:
+            'snap' (dict): flat record of the game state
+
+        Remarks:
+            Same format as 'Game.snapshot'.
+        """
+        snap = {
+            'crashed': self.crashed,
+            'playing': self.playing,
+            'digits': list(str(self.get_score()).zfill(5)),
+            'playCount': self.playCount,
+            'status': self.status,
+            'yPos': self.yPos,
+            'xPos': self.xPos,
+            'speed': self.currentSpeed,
+            'type': None,
+            'config': None,
+            'width': None,
+            'dx': None
+        }
+
+        obstacle_info = self.get_obstacle()
+        if obstacle_info:
+            snap.update(obstacle_info)
+
+        return snap
+
+    def get_dino_state(self):
+        """Get the information about the current state of the dino.
+
+        Return:
+            'dino_state' (dict): dictionary gathering the current dino state
+
+        Remarks:
+            Same format as 'Game.get_dino_state'.
+        """
+        dino_state = {'status': self.status, 'y': self.yPos, 'speed': self.currentSpeed}
+        return dino_state
+
+    def _start_jump(self):
+        """Initialize a jump (Trex.startJump).
+        """
+        self.status = 'JUMPING'
+        self.jumpVelocity = TREX_CONFIG['INITIAL_JUMP_VELOCITY'] - self.currentSpeed / 10
+        self.jumping = True
+        self.reachedMinHeight = False
+        self.speedDrop = False
+
+    def _set_speed_drop(self):
+        """Fast fall while jumping (Trex.setSpeedDrop).
+        """
+        self.speedDrop = True
+        self.jumpVelocity = 1
+
+    def _set_duck(self, isDucking):
+        """Start or stop ducking (Trex.setDuck).
+        """
+        if isDucking and self.status != 'JUMPING':
+            self.status = 'DUCKING'
+            self.ducking = True
+        elif self.status == 'DUCKING':
+            self.status = 'RUNNING'
+            self.ducking = False
+
+    def _update_jump(self, deltaTime):
+        """Update the dino position while jumping (Trex.updateJump).
+        """
+        frames_elapsed = deltaTime / MS_PER_FRAME
+
+        if self.speedDrop:
+            self.yPos += round(self.jumpVelocity * TREX_CONFIG['SPEED_DROP_COEFFICIENT'] * frames_elapsed)
+        else:
+            self.yPos += round(self.jumpVelocity * frames_elapsed)
+        self.jumpVelocity += TREX_CONFIG['GRAVITY'] * frames_elapsed
+
+        # minimum height has been reached
+        if self.yPos < TREX_MIN_JUMP_Y_POS or self.speedDrop:
+            self.reachedMinHeight = True
+
+        # reached the max height
+        if self.yPos < TREX_CONFIG['MAX_JUMP_HEIGHT'] or self.speedDrop:
+            if self.reachedMinHeight and self.jumpVelocity < TREX_CONFIG['DROP_VELOCITY']:
+                self.jumpVelocity = TREX_CONFIG['DROP_VELOCITY']
+
+        # back on the ground
+        if self.yPos > TREX_GROUND_Y_POS:
+            self.yPos = TREX_GROUND_Y_POS
+            self.jumpVelocity = 0.
+            self.jumping = False
+            self.speedDrop = False
+            self.status = 'RUNNING'
+
+    def _add_new_obstacle(self):
+        """Generate a new obstacle (Horizon.addNewObstacle).
+        """
+        while True:
+            typeConfig = OBSTACLE_CONFIGS[self.rng.randint(len(OBSTACLE_CONFIGS))]
+
+            # avoid too many obstacles of the same type in a row and pterodactyls at low speed
+            isDuplicate = self.obstacleHistory.count(typeConfig['type']) >= MAX_OBSTACLE_DUPLICATION
+            if not isDuplicate and self.currentSpeed >= typeConfig['minSpeed']:
+                break
+
+        size = self.rng.randint(1, MAX_OBSTACLE_LENGTH + 1)
+        self.obstacles.append(SimObstacle(typeConfig, size, self.currentSpeed, self.rng))
+
+        self.obstacleHistory.insert(0, typeConfig['type'])
+        del self.obstacleHistory[MAX_OBSTACLE_DUPLICATION:]
+
+    def _update_obstacles(self, deltaTime):
+        """Move the obstacles and generate new ones (Horizon.updateObstacles).
+        """
+        for obstacle in self.obstacles:
+            obstacle.update(deltaTime, self.currentSpeed)
+        # remove the obstacles that left the canvas
+        while self.obstacles and not self.obstacles[0].is_visible():
+            self.obstacles.pop(0)
+
+        if self.obstacles:
+            last_obstacle = self.obstacles[-1]
+            if (not last_obstacle.followingObstacleCreated and last_obstacle.is_visible() and
+                    last_obstacle.xPos + last_obstacle.width + last_obstacle.gap < WIDTH):
+                self._add_new_obstacle()
+                last_obstacle.followingObstacleCreated = True
+        else:
+            self._add_new_obstacle()
+
+    def _check_for_collision(self, obstacle):
+        """Check if the dino collides with the given obstacle (checkForCollision).
+        """
+        trex_box = (self.xPos + 1, self.yPos + 1, TREX_CONFIG['WIDTH'] - 2, TREX_CONFIG['HEIGHT'] - 2)
+        obstacle_box = (obstacle.xPos + 1, obstacle.yPos + 1, obstacle.width - 2, obstacle.typeConfig['height'] - 2)
+
+        # simple outer bounds check
+        if not box_compare(trex_box, obstacle_box):
+            return False
+
+        # detailed check
+        trex_collision_boxes = TREX_COLLISION_BOXES['DUCKING' if self.ducking else 'RUNNING']
+        for trex_collision_box in trex_collision_boxes:
+            adj_trex_box = (trex_collision_box[0] + trex_box[0], trex_collision_box[1] + trex_box[1]) + trex_collision_box[2:]
+            for obstacle_collision_box in obstacle.collisionBoxes:
+                adj_obstacle_box = (obstacle_collision_box[0] + obstacle_box[0], obstacle_collision_box[1] + obstacle_box[1]) + obstacle_collision_box[2:]
+                if box_compare(adj_trex_box, adj_obstacle_box):
+                    return True
+
+        return False
+
+    def _update(self, deltaTime):
+        """Advance the simulation by one frame (Runner.update).
+
+        Args:
+            'deltaTime' (float): time elapsed since the last frame (in ms)
+        """
+        if not self.playing:
+            return
+
+        if self.jumping:
+            self._update_jump(deltaTime)
+
+        self.runningTime += deltaTime
+        hasObstacles = self.runningTime > self.config['CLEAR_TIME']
+
+        if hasObstacles:
+            self._update_obstacles(deltaTime)
+
+        # check for collisions
+        if hasObstacles and self.obstacles and self._check_for_collision(self.obstacles[0]):
+            # game over
+            self.crashed = True
+            self.playing = False
+            self._add_event('gameOver')
+        else:
+            self.distanceRan += self.currentSpeed * deltaTime / MS_PER_FRAME
+            if self.currentSpeed < self.config['MAX_SPEED']:
+                self.currentSpeed += self.config['ACCELERATION']
+
+
+if __name__=='__main__':
+    # get arguments needed to play the Game
+    args = get_game_args()
+    # create a simulated game
+    game = SimGame(args)
+    # launch the game by jumping
+    game.press_up()
+    # run until crash, jumping as soon as possible
+    while game.get_playing():
+        game.press_up()
+        game.wait(args.dt)
+    print("The Dino has crashed:", game.get_crashed())
+    print("Score:", game.get_score())
@@ -0,0 +1,538 @@
+"""Solvers of the approximate Markov Decision Process.
+
+Authors:
+    Gael Colas
+"""
+
+import heapq
+import time
+
+import numpy as np
+
+# fraction of the states queued at once by prioritized sweeping above which it falls back to full sweeps
+SWEEP_FRACTION = 0.1
+# number of single state backups of prioritized sweeping, per state, above which it falls back to full sweeps
+SWEEP_BACKUPS = 1.
+# number of policy evaluation sweeps between two policy improvements in modified policy iteration
+EVALUATION_SWEEPS = 20
+
+
+def bellman_update(transitions, reward, value, gamma):
+    """Apply the Bellman optimality operator to the value function.
+
+    Args:
+        'transitions' (SparseTransitions): transition counts of the approximate MDP
+        'reward' (np.array, [num_states]): reward function
+        'value' (np.array, [num_states]): value function
+        'gamma' (float): discount factor
+
+    Return:
+        'new_value' (np.array, [num_states]): updated value function
+    """
+    return reward + gamma * np.max(transitions.expected_values(value), axis=1)
+
+
+def gather_segments(indptr, segments):
+    """Gather the indices of several segments of a CSR-like storage.
+
+    Args:
+        'indptr' (np.array of int): segment i is stored in [indptr[i], indptr[i+1])
+        'segments' (np.array of int): indices of the segments to gather
+
+    Return:
+        'indices' (np.array of int): storage indices of all the elements of the segments
+        'segment_ids' (np.array of int): position in 'segments' of the segment of each element
+    """
+    starts, lengths = indptr[segments], indptr[segments + 1] - indptr[segments]
+    segment_ids = np.repeat(np.arange(segments.size), lengths)
+    indices = np.arange(segment_ids.size) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[segment_ids]
+    return indices, segment_ids
+
+
+def bellman_backup(transitions, reward, value, gamma, states, mean_value=None):
+    """Apply the Bellman optimality operator to the given states only, solving their self-transitions in closed form.
+    For each action: V_a(x) = (R(x) + gamma*sum_{x' != x} p(x'|x,a) V(x')) / (1 - gamma*p(x|x,a)), and V(x) = max_a V_a(x).
+
+    Args:
+        'transitions' (SparseTransitions): transition counts of the approximate MDP
+        'reward' (np.array, [num_states]): reward function
+        'value' (np.array, [num_states]): value function
+        'gamma' (float): discount factor
+        'states' (np.array of int): states to update
+        'mean_value' (float, default=None): mean of the value function, computed if None
+
+    Return:
+        'new_value' (np.array, [len(states)]): updated value of the given states
+
+    Remarks:
+        The fixed point of the max of the contracting maps V -> R + gamma*(p(x|x,a) V + ...) is the max of their fixed points:
+        a state with a self-transition is updated to its fixed point given the other values, in a single backup.
+    """
+    num_actions, probs, cols, indptr = transitions.num_actions, transitions.probs(), transitions.cols, transitions.indptr
+    if mean_value is None:
+        mean_value = np.mean(value)
+
+    rows = (states[:, np.newaxis]*num_actions + np.arange(num_actions)).ravel()
+    indices, row_ids = gather_segments(indptr, rows)
+    row_states = np.repeat(states, num_actions)
+    isSelf = cols[indices] == row_states[row_ids]
+
+    # expected value of the other states, and probability of staying
+    q_others = np.bincount(row_ids, weights=np.where(isSelf, 0., probs[indices]*value[cols[indices]]), minlength=rows.size)
+    p_self = np.bincount(row_ids, weights=isSelf*probs[indices], minlength=rows.size)
+    # uniform transition probability for the unobserved pairs
+    q_others[indptr[rows + 1] == indptr[rows]] = mean_value
+
+    q_values = (reward[row_states] + gamma*q_others) / (1 - gamma*p_self)
+
+    return np.max(q_values.reshape(-1, num_actions), axis=1)
+
+
+def backward_levels(transitions):
+    """Order the states by distance to the states without observed transitions (such as the FAIL state), in the reversed transition graph.
+
+    Args:
+        'transitions' (SparseTransitions): transition counts of the approximate MDP
+
+    Return:
+        'levels' (list of np.array of int): states at each distance, the states that cannot reach any state without observed transitions are last
+
+    Remarks:
+        The states of a level only transition to the previous levels, to their own level, or backwards along a cycle.
+    """
+    num_states, num_actions, cols = transitions.num_states, transitions.num_actions, transitions.cols
+
+    # predecessors of each state: transposed storage, sorted by new state
+    order = np.argsort(cols, kind='stable')
+    pred_indptr = np.searchsorted(cols[order], np.arange(num_states + 1))
+    predecessors = transitions.rows[order] // num_actions
+
+    reached = np.zeros(num_states, dtype=bool)
+    frontier = np.flatnonzero(~np.any(transitions.visited(), axis=1))
+    reached[frontier] = True
+    levels = []
+    while frontier.size:
+        levels.append(frontier)
+        frontier = np.unique(predecessors[gather_segments(pred_indptr, frontier)[0]])
+        frontier = frontier[~reached[frontier]]
+        reached[frontier] = True
+    if not reached.all():
+        levels.append(np.flatnonzero(~reached))
+
+    return levels
+
+
+def solve(solver, transitions, reward, value, gamma, tolerance, changed_states=None):
+    """Solve the approximate MDP with the given solver and report its statistics.
+
+    Args:
+        'solver' (str): name of the solver in SOLVERS
+        'transitions' (SparseTransitions): transition counts of the approximate MDP
+        'reward' (np.array, [num_states]): reward function
+        'value' (np.array, [num_states]): initial value function
+        'gamma' (float): discount factor
+        'tolerance' (float): convergence criterium: maximum change of the value function between two sweeps
+        'changed_states' (np.array of int, default=None): states whose transitions or reward changed since the last solve
+
+    Return:
+        'value' (np.array, [num_states]): converged value function
+        'stats' (dict): solver statistics: 'solver', number of 'iterations', final Bellman 'residual' and wall 'time' (in s)
+    """
+    start_time = time.perf_counter()
+    value, iterations, residual = SOLVERS[solver](transitions, reward, value, gamma, tolerance, changed_states)
+
+    stats = {
+        'solver': solver,
+        'iterations': iterations,
+        'residual': residual,
+        'time': time.perf_counter() - start_time
+    }
+    return value, stats
+
+
+def value_iteration(transitions, reward, value, gamma, tolerance, changed_states=None):
+    """Solve for the optimal value function through Value Iteration.
+
+    Args:
+        'transitions' (SparseTransitions): transition counts of the approximate MDP
+        'reward' (np.array, [num_states]): reward function
+        'value' (np.array, [num_states]): initial value function
+        'gamma' (float): discount factor
+        'tolerance' (float): convergence criterium: maximum change of the value function between two sweeps
+        'changed_states' (np.array of int, default=None): unused
+
+    Return:
+        'value' (np.array, [num_states]): converged value function
+        'iterations' (int): number of sweeps
+        'residual' (float): maximum change of the value function during the last sweep
+    """
+    iterations = 0
+    while True:
+        # Bellman update
+        new_value = bellman_update(transitions, reward, value, gamma)
+        iterations += 1
+
+        # difference with previous value function
+        max_diff = np.max(np.abs(new_value - value))
+
+        value = new_value
+
+        # check for convergence
+        if max_diff < tolerance:
+            return value, iterations, max_diff
+
+
+def gauss_seidel_value_iteration(transitions, reward, value, gamma, tolerance, changed_states=None):
+    """Solve for the optimal value function through Gauss-Seidel Value Iteration.
+    The value function is updated in place, level after level of 'backward_levels': the successors of a state are mostly updated before it.
+    The self-transitions are solved in closed form, see 'bellman_backup'.
+
+    Args:
+        see 'value_iteration'
+
+    Return:
+        'value' (np.array, [num_states]): converged value function
+        'iterations' (int): number of sweeps
+        'residual' (float): maximum change of the value function during the last sweep
+
+    Remarks:
+        The mean value used by the unobserved (state, action) pairs is updated incrementally after each level.
+    """
+    num_states = transitions.num_states
+    levels = backward_levels(transitions)
+
+    value = value.copy()
+    total = np.sum(value)
+    iterations = 0
+    while True:
+        # in place Bellman update
+        max_diff = 0.
+        for states in levels:
+            new_value = bellman_backup(transitions, reward, value, gamma, states, total / num_states)
+            diff = new_value - value[states]
+            max_diff = max(max_diff, np.max(np.abs(diff)))
+            total += np.sum(diff)
+            value[states] = new_value
+        iterations += 1
+
+        # check for convergence
+        if max_diff < tolerance:
+            return value, iterations, max_diff
+
+
+def evaluate_policy(transitions, reward, policy, gamma):
+    """Compute the value function of a policy by solving the linear system: V = R + gamma*P_policy V.
+
+    Args:
+        'transitions' (SparseTransitions): transition counts of the approximate MDP
+        'reward' (np.array, [num_states]): reward function
+        'policy' (np.array of int, [num_states]): action chosen in each state
+        'gamma' (float): discount factor
+
+    Return:
+        'value' (np.array, [num_states]): value function of the policy
+
+    Remarks:
+        The system is solved directly with a dense matrix: O(num_states^3) time and O(num_states^2) memory.
+    """
+    num_states, num_actions = transitions.num_states, transitions.num_actions
+    probs, rows, cols, indptr = transitions.probs(), transitions.rows, transitions.cols, transitions.indptr
+
+    # transition matrix of the policy
+    policy_rows = np.arange(num_states)*num_actions + policy
+    transition_matrix = np.zeros((num_states, num_states))
+    transition_matrix[indptr[policy_rows + 1] == indptr[policy_rows]] = 1. / num_states
+    selected = (rows % num_actions) == policy[rows // num_actions]
+    transition_matrix[rows[selected] // num_actions, cols[selected]] = probs[selected]
+
+    return np.linalg.solve(np.eye(num_states) - gamma*transition_matrix, reward)
+
+
+def greedy_policy(transitions, value, policy=None):
+    """Get the greedy policy with respect to a value function.
+
+    Args:
+        'transitions' (SparseTransitions): transition counts of the approximate MDP
+        'value' (np.array, [num_states]): value function
+        'policy' (np.array of int, [num_states], default=None): current policy, kept in case of ties
+
+    Return:
+        'policy' (np.array of int, [num_states]): greedy action in each state
+    """
+    q_values = transitions.expected_values(value)
+    new_policy = np.argmax(q_values, axis=1)
+
+    if policy is not None:
+        # keep the current action if it is as good as the greedy one
+        ties = q_values[np.arange(value.size), policy] >= q_values[np.arange(value.size), new_policy]
+        new_policy[ties] = policy[ties]
+
+    return new_policy
+
+
+def policy_iteration(transitions, reward, value, gamma, tolerance, changed_states=None):
+    """Solve for the optimal value function through Policy Iteration.
+    Each policy is evaluated exactly with a direct linear solve, then improved greedily until it is stable.
+
+    Args:
+        see 'value_iteration'
+
+    Return:
+        'value' (np.array, [num_states]): value function of the optimal policy
+        'iterations' (int): number of policy improvements
+        'residual' (float): maximum change of the value function by a Bellman update
+    """
+    policy = greedy_policy(transitions, value)
+
+    iterations = 0
+    while True:
+        # policy evaluation
+        value = evaluate_policy(transitions, reward, policy, gamma)
+        iterations += 1
+
+        # policy improvement
+        new_policy = greedy_policy(transitions, value, policy)
+        if np.array_equal(new_policy, policy):
+            residual = np.max(np.abs(bellman_update(transitions, reward, value, gamma) - value))
+            return value, iterations, residual
+
+        policy = new_policy
+
+
+def modified_policy_iteration(transitions, reward, value, gamma, tolerance, changed_states=None):
+    """Solve for the optimal value function through Modified Policy Iteration.
+    Each greedy policy is only evaluated approximately with a few sweeps of its Bellman operator.
+
+    Args:
+        see 'value_iteration'
+
+    Return:
+        'value' (np.array, [num_states]): converged value function
+        'iterations' (int): number of policy improvements
+        'residual' (float): maximum change of the value function by the last Bellman update
+    """
+    num_states = transitions.num_states
+
+    iterations = 0
+    while True:
+        # policy improvement
+        q_values = transitions.expected_values(value)
+        policy = np.argmax(q_values, axis=1)
+        new_value = reward + gamma*q_values[np.arange(num_states), policy]
+        iterations += 1
+
+        # check for convergence
+        residual = np.max(np.abs(new_value - value))
+        value = new_value
+        if residual < tolerance:
+            return value, iterations, residual
+
+        # partial policy evaluation
+        for _ in range(EVALUATION_SWEEPS - 1):
+            value = reward + gamma*transitions.expected_values(value)[np.arange(num_states), policy]
+
+
+def prioritized_sweeping(transitions, reward, value, gamma, tolerance, changed_states=None):
+    """Update the value function incrementally through Prioritized Sweeping.
+    Only the states whose model changed are backed up at first, the value changes are then propagated to their predecessors by decreasing priority.
+
+    Args:
+        'transitions' (SparseTransitions): transition counts of the approximate MDP
+        'reward' (np.array, [num_states]): reward function
+        'value' (np.array, [num_states]): value function converged for the previous model
+        'gamma' (float): discount factor
+        'tolerance' (float): convergence criterium: maximum change of the value function between two sweeps
+        'changed_states' (np.array of int, default=None): states whose transitions or reward changed since the last solve, all the states if None
+
+    Return:
+        'value' (np.array, [num_states]): converged value function
+        'iterations' (int): number of single state backups and of full sweeps
+        'residual' (float): maximum change of the value function by a full Bellman update
+
+    Remarks:
+        The priority queue is a heap: each popped state is backed up alone, in O(number of its transitions).
+        The priority of a predecessor x of a state x' whose value changed by delta is gamma*max_a p(x'|x,a)*|delta|.
+        The unobserved (state, action) pairs depend on the mean value: it is kept up to date with the running sum of the values.
+        The mean value is a predecessor of the states reading it: once it has drifted enough, they are queued with priority dV(x)/dmean*|drift|.
+        The priorities are bounds on the residuals of single changes: the states notified of changes below 'tolerance' are only checked once the queue is empty.
+        The value function is returned once a full Bellman update changes it by less than 'tolerance', same guarantee as 'value_iteration'.
+        Full sweeps are only a safeguard: when more than a tenth of the states are queued at once, or after as many single state backups as states.
+    """
+    num_states, num_actions = transitions.num_states, transitions.num_actions
+    max_queued = max(1, int(SWEEP_FRACTION * num_states))
+    max_backups = max(1, int(SWEEP_BACKUPS * num_states))
+
+    # predecessors of each state, with the transition probabilities: transposed storage, sorted by new state
+    order = np.argsort(transitions.cols, kind='stable')
+    pred_indptr = np.concatenate(([0], np.cumsum(np.bincount(transitions.cols, minlength=num_states))))
+    predecessors = (transitions.rows[order] // num_actions).tolist()
+    pred_probs = (gamma*transitions.probs()[order]).tolist()
+
+    # states never observed: V(x) = R(x) + gamma*mean(V), solved in closed form
+    indptr = transitions.indptr
+    unobserved = indptr[num_actions::num_actions] == indptr[:-1:num_actions]
+    observed = ~unobserved
+    n_unobserved = num_states - np.count_nonzero(observed)
+    unobserved_reward = np.sum(reward[unobserved])
+
+    # Python lists: the single state backups only do scalar accesses, much faster than on arrays
+    probs, cols, toUnobserved = transitions.probs().tolist(), transitions.cols.tolist(), unobserved[transitions.cols].tolist()
+    reward_list = reward.tolist()
+
+    # sensitivity of the value of each state to the mean value, through its unobserved pairs and its transitions to unobserved states
+    num_rows = num_states*num_actions
+    isSelf = transitions.cols == transitions.rows // num_actions
+    p_self = np.bincount(transitions.rows, weights=isSelf*transitions.probs(), minlength=num_rows)
+    p_unobserved = np.bincount(transitions.rows, weights=unobserved[transitions.cols]*transitions.probs(), minlength=num_rows)
+    mean_weights = np.where(np.diff(indptr) == 0, gamma, gamma**2 * p_unobserved / (1 - gamma*p_self))
+    # the unobserved states are solved in closed form
+    observed_states = np.flatnonzero(observed)
+    mean_weights = np.max(mean_weights.reshape(num_states, num_actions)[observed_states], axis=1)
+    readers, reader_weights = observed_states[mean_weights > 0], mean_weights[mean_weights > 0]
+    max_weight = np.max(reader_weights, initial=0.)
+    readers, reader_weights = readers.tolist(), reader_weights.tolist()
+
+    def solve_unobserved(value):
+        """Set the value of the unobserved states consistently with the mean value."""
+        mean_value = (np.sum(value[observed]) + unobserved_reward) / (num_states - gamma*n_unobserved)
+        value[unobserved] = reward[unobserved] + gamma*mean_value
+
+    def backup(state):
+        """Bellman update of a single state, with its self-transitions solved in closed form, see 'bellman_backup'."""
+        best = -np.inf
+        bounds = indptr[state*num_actions:(state + 1)*num_actions + 1].tolist()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                # uniform transition probability for the unobserved pairs
+                q_value = reward_list[state] + gamma*mean_value
+            else:
+                q_others, p_self = 0., 0.
+                for k in range(start, end):
+                    col = cols[k]
+                    if col == state:
+                        p_self += probs[k]
+                    elif toUnobserved[k]:
+                        q_others += probs[k]*(reward_list[col] + gamma*mean_value)
+                    else:
+                        q_others += probs[k]*value_list[col]
+                q_value = (reward_list[state] + gamma*q_others) / (1 - gamma*p_self)
+            if q_value > best:
+                best = q_value
+        return best
+
+    value = value.copy()
+    solve_unobserved(value)
+
+    # priority queue of the states to back up
+    if changed_states is None:
+        states = np.arange(num_states)
+    else:
+        states = np.unique(np.asarray(changed_states, dtype=int))
+    residuals = np.abs(bellman_backup(transitions, reward, value, gamma, states) - value[states])
+    queued = states[residuals >= tolerance]
+    residuals = residuals[residuals >= tolerance]
+
+    iterations = 0
+    if queued.size <= max_queued:
+        value_list = value.tolist()
+        # the values of the unobserved states follow the mean value: only the sum of the observed ones is kept
+        observed_total = np.sum(value[observed])
+        mean_value = (observed_total + unobserved_reward) / (num_states - gamma*n_unobserved)
+        # mean value at the last backup of each state, and at the last check of the states reading it
+        backup_mean = [mean_value]*num_states
+        checked_mean = mean_value
+
+        priority = [0.]*num_states
+        heap = []
+        for state, residual in zip(queued.tolist(), residuals.tolist()):
+            priority[state] = residual
+            heap.append((-residual, state))
+        heapq.heapify(heap)
+        # states backed up since the last check, and states whose successors changed too little to queue them
+        updated, suspects = [], set()
+
+        while iterations < max_backups:
+            # queue the states reading the mean value that it changed enough since their last backup
+            if mean_value != checked_mean and (not heap or max_weight*abs(mean_value - checked_mean) >= tolerance):
+                checked_mean = mean_value
+                for state, weight in zip(readers, reader_weights):
+                    mean_priority = weight*abs(mean_value - backup_mean[state])
+                    if mean_priority < tolerance:
+                        suspects.add(state)
+                    elif mean_priority > priority[state]:
+                        priority[state] = mean_priority
+                        heapq.heappush(heap, (-mean_priority, state))
+
+            # once the queue is empty, queue the residuals left by the bounds on the priorities:
+            # first of the suspected states, then of all the states to check the convergence
+            if not heap:
+                value[updated] = [value_list[state] for state in updated]
+                updated = []
+                solve_unobserved(value)
+                if suspects:
+                    checked = np.fromiter(suspects, dtype=int, count=len(suspects))
+                    suspects.clear()
+                    residuals = np.abs(bellman_backup(transitions, reward, value, gamma, checked, mean_value) - value[checked])
+                else:
+                    checked = np.arange(num_states)
+                    residuals = np.abs(bellman_update(transitions, reward, value, gamma) - value)
+                    max_residual = np.max(residuals)
+                    if max_residual < tolerance:
+                        return value, iterations, max_residual
+
+                isQueued = residuals >= tolerance
+                if np.count_nonzero(isQueued) > max_queued:
+                    break
+                for state, residual in zip(checked[isQueued].tolist(), residuals[isQueued].tolist()):
+                    priority[state] = residual
+                    heapq.heappush(heap, (-residual, state))
+                continue
+
+            # pop the state with the largest priority, skip the outdated entries
+            neg_priority, state = heapq.heappop(heap)
+            if -neg_priority != priority[state]:
+                continue
+            priority[state] = 0.
+
+            new_value = backup(state)
+            backup_mean[state] = mean_value
+            delta = abs(new_value - value_list[state])
+            observed_total += new_value - value_list[state]
+            mean_value = (observed_total + unobserved_reward) / (num_states - gamma*n_unobserved)
+            value_list[state] = new_value
+            updated.append(state)
+            iterations += 1
+
+            # update the priorities of the predecessors
+            start, end = pred_indptr[state:state + 2].tolist()
+            for k in range(start, end):
+                pred, pred_priority = predecessors[k], pred_probs[k]*delta
+                if pred_priority < tolerance:
+                    suspects.add(pred)
+                elif pred_priority > priority[pred]:
+                    priority[pred] = pred_priority
+                    heapq.heappush(heap, (-pred_priority, pred))
+
+        value[updated] = [value_list[state] for state in updated]
+        solve_unobserved(value)
+
+    # full sweeps as a safeguard, until a full Bellman update changes the value function by less than 'tolerance'
+    while True:
+        new_value = bellman_update(transitions, reward, value, gamma)
+        max_residual = np.max(np.abs(new_value - value))
+        if max_residual < tolerance:
+            return value, iterations, max_residual
+
+        value = new_value
+        solve_unobserved(value)
+        iterations += 1
+
+
+# available solvers, selectable with the 'solver' argument
+SOLVERS = {
+    'value_iteration': value_iteration,
+    'gauss_seidel': gauss_seidel_value_iteration,
+    'policy_iteration': policy_iteration,
+    'modified_policy_iteration': modified_policy_iteration,
+    'prioritized_sweeping': prioritized_sweeping
+}
@@ -0,0 +1,115 @@
+"""AI agent learning an action-value function online by temporal differences.
+
+Authors:
+    Gael Colas
+"""
+
+from abc import ABC, abstractmethod
+
+from agent import AIAgent
+
+
+class OnlineTDAgent(AIAgent, ABC):
+    """AI agent controlling the Dino with an action-value function learned online by Q-learning.
+    Each transition updates the action-values of the previous (state, action) pair: there is no model to solve at the end of a simulation.
+
+    Attributes:
+        'alpha' (float): learning rate of Q-learning
+        'terminal' (bool): whether the last recorded transition ended the simulation
+
+    Remarks:
+        The interface is the one of 'AIAgent': 'choose_action', 'set_transition' and 'reset'.
+        The subclasses define the representation of the action-values: the abstract methods 'get_q_values' and 'update_q_values'.
+    """
+    def __init__(self, args, dino):
+        self.alpha = args.alpha
+        self.terminal = False
+
+        super().__init__(args, dino)
+        # nothing to solve in the background
+        self.async_solve = False
+
+    @abstractmethod
+    def get_q_values(self, state):
+        """Get the action-values of a state.
+
+        Args:
+            'state' (dict): state of the Dino
+
+        Return:
+            'q_values' (np.array, [2]): value of each action in the state
+        """
+
+    @abstractmethod
+    def update_q_values(self, state, action, new_state, reward, isCrashed):
+        """Q-learning update of the action-value of the previous (state, action) pair.
+
+        Args:
+            'state' (dict): previous state of the Dino
+            'action' (int, 0 or 1): last action performed
+            'new_state' (dict): new state after performing the action in the previous state
+            'reward' (float): reward observed in the new state
+            'isCrashed' (bool): whether the new state ends the simulation
+        """
+
+    def get_td_target(self, new_state, reward, isCrashed):
+        """Get the temporal difference target of a transition: no future value after a crash.
+
+        Args:
+            'new_state' (dict): new state of the transition
+            'reward' (float): reward observed in the new state
+            'isCrashed' (bool): whether the new state ends the simulation
+
+        Return:
+            'target' (float): reward + gamma*max_a Q(new_state, a)
+        """
+        if isCrashed:
+            return reward
+        return reward + self.gamma * self.get_q_values(new_state).max()
+
+    def best_action(self, state):
+        """Choose the next action (0 or 1) that is optimal according to the current action-values.
+        When there is no optimal action, return 0 has "do nothing" is more frequent.
+
+        Args:
+            'state' (dict): current state of the Dino
+
+        Return:
+            'action' (int, 0 or 1): optimal action in the current state
+        """
+        q_values = self.get_q_values(state)
+
+        # DUCK ACTION NOT USED: CAN BEAT GAME WITHOUT DUCKING
+
+        return int(q_values[1] > q_values[0])
+
+    def set_transition(self):
+        """Update the action-values with the given transition.
+        """
+        # the transition recorded again at the beginning of 'reset' has already been learned
+        if self.terminal:
+            self.terminal = False
+            self.state = self.dino.get_state()
+            return
+
+        # whether the Game has been failed at the new state
+        isCrashed = self.dino.is_crashed()
+        # get the new state
+        new_state = self.dino.get_state()
+        # whether an obstacle has been passed
+        obsPassed = bool(self.state and new_state) and new_state['dx'] > self.state['dx']
+        # get the previous state reward
+        reward = self.get_reward(isCrashed, obsPassed)
+        # learn the given transition
+        self.update_q_values(self.state, self.action, new_state, reward, isCrashed)
+        if self.transition_logger:
+            self.transition_logger.log(self.state, self.action, new_state, reward, isCrashed)
+
+        # update the current state
+        self.state = new_state
+        self.terminal = isCrashed
+
+    def update_mdp_parameters(self):
+        """Nothing to solve at the end of a simulation: the action-values are learned online.
+        """
+        pass
@@ -0,0 +1,130 @@
+"""AI agent using a tile-coded linear action-value function.
+
+Authors:
+    Gael Colas
+"""
+
+import numpy as np
+
+from agent import PTERODACTYL_HEIGHTS
+from mdp import UniformGrid
+from td_agent import OnlineTDAgent
+
+
+class TileCodingAgent(OnlineTDAgent):
+    """AI agent controlling the Dino with a tile-coded linear approximation of the action-value function.
+    The agent is trained online by Q-learning: each transition updates the weights of the active tiles.
+
+    The continuous state (dt, y) is covered by several overlapping tilings, shifted from each other by a fraction of a tile.
+    Each obstacle level (pterodactyl flight level, ground obstacle, no obstacle) has its own tiles.
+    Q(x,a) is the sum of the weights of the active tile of each tiling: acting and learning cost O(n_tilings), whatever the resolution.
+
+    Attributes:
+        'n_tilings' (int): number of tilings
+        'n_tiles' (int): number of tiles of a tiling along each dimension
+        'tile_width' (np.array, [2]): width of a tile along dt and y
+        'offsets' (np.array, [n_tilings, 2]): shift of each tiling, in tiles
+        'tile_base' (np.array of int, [n_tilings]): index of the first tile of each tiling
+        'level_grid' (UniformGrid): discretization of the pterodactyl flight levels
+
+        'mdp_data' (dict): parameters of the agent: 'weights' (np.array, [num_features, 2]) and the tiling parameters
+
+    Remarks:
+        The online learning is the one of 'OnlineTDAgent'.
+    """
+    def __init__(self, args, dino):
+        self.n_tilings = args.n_tilings
+        self.n_tiles = args.n_tiles
+
+        super().__init__(args, dino)
+
+    def initialize_mdp_data(self):
+        """Save a attributes 'mdp_data' that contains the parameters of the agent.
+
+        Parameters:
+            'num_features' (int): the number of tiles.
+                    num_features = n_tilings * (n_pter_levels + 2) * (n_tiles + 1)^2
+
+        Initialization scheme:
+            - Weights initialized to 0
+        """
+        # one more tile per dimension: the shifted tilings overflow the state space
+        num_features = self.n_tilings * (len(PTERODACTYL_HEIGHTS) + 2) * (self.n_tiles + 1)**2
+
+        self.mdp_data = {
+            'num_features': num_features,
+            'n_tilings': self.n_tilings,
+            'n_tiles': self.n_tiles,
+            'max_dt': float(self.args.max_dt),
+            'max_y': float(self.args.max_y),
+            'weights': np.zeros((num_features, 2))
+        }
+        self.set_tiling()
+
+    def set_mdp_data(self, mdp_data):
+        """Replace the parameters of the agent, for instance with loaded ones.
+
+        Args:
+            'mdp_data' (dict): parameters of the agent, see 'initialize_mdp_data'
+        """
+        self.mdp_data = mdp_data
+        self.n_tilings = mdp_data['n_tilings']
+        self.n_tiles = mdp_data['n_tiles']
+        self.set_tiling()
+
+    def set_tiling(self):
+        """Precompute the geometry of the tilings from 'mdp_data'.
+        """
+        n_levels = len(PTERODACTYL_HEIGHTS) + 2
+
+        self.tile_width = np.array([self.mdp_data['max_dt'], self.mdp_data['max_y']]) / self.n_tiles
+        # tilings uniformly shifted along the diagonal
+        self.offsets = np.repeat(np.arange(self.n_tilings)[:, np.newaxis] / self.n_tilings, 2, axis=1)
+        self.tile_base = np.arange(self.n_tilings) * n_levels * (self.n_tiles + 1)**2
+        self.level_grid = UniformGrid(PTERODACTYL_HEIGHTS)
+
+    def get_active_tiles(self, state):
+        """Get the active tile of each tiling.
+
+        Args:
+            'state' (dict): state of the Dino, None if no obstacle has been created yet
+
+        Return:
+            'tiles' (np.array of int, [n_tilings]): indices of the active tiles
+        """
+        if not state: # no obstacle created yet
+            level = len(PTERODACTYL_HEIGHTS) + 1
+            x = np.array([self.mdp_data['max_dt'], 0.])
+        else:
+            if state['type'] == "PTERODACTYL":
+                level = self.level_grid.closest(state['config'])
+            else:
+                level = len(PTERODACTYL_HEIGHTS)
+            x = np.array([state['dt'], state['y']])
+
+        # tile coordinates in each tiling
+        coords = np.floor(np.clip(x, 0, [self.mdp_data['max_dt'], self.mdp_data['max_y']]) / self.tile_width + self.offsets).astype(int)
+
+        return self.tile_base + (level*(self.n_tiles + 1) + coords[:, 0])*(self.n_tiles + 1) + coords[:, 1]
+
+    def get_q_values(self, state):
+        """Get the approximate action-values of a state.
+
+        Args:
+            'state' (dict): state of the Dino
+
+        Return:
+            'q_values' (np.array, [2]): value of each action in the state
+        """
+        return self.mdp_data['weights'][self.get_active_tiles(state)].sum(axis=0)
+
+    def update_q_values(self, state, action, new_state, reward, isCrashed):
+        """Q-learning update of the weights of the active tiles, see 'OnlineTDAgent.update_q_values'.
+        """
+        tiles = self.get_active_tiles(state)
+        weights = self.mdp_data['weights']
+
+        td_error = self.get_td_target(new_state, reward, isCrashed) - weights[tiles, action].sum()
+
+        # each tiling shares the step
+        weights[tiles, action] += self.alpha / self.n_tilings * td_error
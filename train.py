@@ -10,6 +10,14 @@ from util import *
 from args import get_game_args
 from dino import Dino
 from agent import AIAgent
+from tile_agent import TileCodingAgent
+from partition import AdaptiveAgent
+from q_agent import QLearningAgent
+from translog import TransitionLogger
+from profiler import Profiler, GAME_METHODS, DINO_METHODS, AGENT_METHODS
+
+# AI agents selectable with '--agent'
+AGENTS = {'ai': AIAgent, 'tile': TileCodingAgent, 'adaptive': AdaptiveAgent, 'q': QLearningAgent}
 
 class Gym:
     """'Gym' class: train the AI agent
@@ -23,11 +31,16 @@ class Gym:
         't' (int): number of time steps since the beginning of the game
         
         'agent' (AIAgent, default=None): AI agent playing the game
+        'checkpoint_writer' (CheckpointWriter): saves the agent parameters in the background
+        'profiler' (Profiler): times the calls of the control loop, None if not profiling
     """
     
     def __init__(self, args):
         super(Gym).__init__()
         self.args = args
+        # reproducible exploration
+        if args.seed is not None:
+            np.random.seed(args.seed)
                 
         # environment parameters
         self.dino = Dino(args)
@@ -39,10 +52,24 @@ class Gym:
         # to play with an AI
         self.isHuman = (args.agent == "human")
         if not self.isHuman:
-            self.agent = AIAgent(args, self.dino)
+            self.agent = AGENTS[args.agent](args, self.dino)
             # load saved parameters
             if self.args.load_save:
                 load_agent(self.agent, self.args.save_filename)
+            # log the raw transitions
+            if self.args.transition_log:
+                self.agent.transition_logger = TransitionLogger(self.args.transition_log)
+        self.checkpoint_writer = CheckpointWriter()
+        
+        # time the calls of the control loop
+        self.profiler = None
+        if args.profile:
+            self.profiler = Profiler(args.trace_filename, args.trace_start, args.trace_steps)
+            self.profiler.instrument(self.dino.game, GAME_METHODS, "game.")
+            self.profiler.instrument(self.dino, DINO_METHODS, "dino.")
+            if not self.isHuman:
+                self.profiler.instrument(self.agent, AGENT_METHODS, "agent.")
+            self.profiler.instrument(self, ("step",), "gym.")
                 
         # listen to user inputs
         self.inputs_list = []
@@ -76,11 +103,19 @@ class Gym:
                 if not self.isHuman: 
                     # check if the game is not paused
                     if not self.dino.is_playing() and self.args.play_bg:
-                        self.dino.game.resume()
+                        self.dino.resume()
                     
                     # take a step if the AI is playing
                     if self.dino.is_playing():
                         self.step()
+                        if self.profiler:
+                            self.profiler.next_step()
+                    else:
+                        # sleep until the game is resumed
+                        self.dino.wait_events()
+                else:
+                    # sleep until the game played by the human is over
+                    self.dino.wait_events()
 
             # otherwise launch a new game
             else:
@@ -97,12 +132,16 @@ class Gym:
                 update_score(self.highscore, self.args.highscore_filename)
                 
                 # display command info
-                display_info(self.dino.get_n_sim(), self.highscore, self.args.commands_filename)
+                display_info(self.dino.get_n_sim(), self.highscore, self.args.commands_filename,
+                             None if self.isHuman else self.agent.solve_stats, self.profiler, self.dino.scheduler)
                 handle_user_command(self)
 
                 if not self.isHuman: 
                     # save the last simulation
                     self.agent.reset()
+                    # periodic autosave
+                    if self.args.autosave_every > 0 and self.dino.get_n_sim() % self.args.autosave_every == 0:
+                        self.checkpoint_writer.save(self.agent, self.args.save_filename)
                 else: 
                     self.dino.start()
                 
@@ -0,0 +1,163 @@
+"""Append-only binary log of the transitions observed by the AI agent.
+
+Authors:
+    Gael Colas
+
+Remarks:
+    The log is a small header followed by fixed-size records: it can be memory-mapped as a NumPy structured array.
+    The continuous states are logged: the approximate MDP can be rebuilt offline with any discretization.
+"""
+
+import os
+
+import numpy as np
+
+from mdp import OBSTACLE_TYPES
+
+# first bytes of a transition log, with the version of the record format
+LOG_MAGIC = b'DINOLOG1'
+
+# continuous state of the Dino, see 'Dino.get_state' ('type' is the code of OBSTACLE_TYPES, -1 if no obstacle)
+STATE_DTYPE = np.dtype([
+    ('dx', np.float64),
+    ('dt', np.float64),
+    ('y', np.float64),
+    ('speed', np.float64),
+    ('type', np.int8),
+    ('config', np.float64)
+])
+
+# one transition: state, action, new state, reward earned in the new state and whether the new state is failed
+RECORD_DTYPE = np.dtype([
+    ('state', STATE_DTYPE),
+    ('action', np.int8),
+    ('new_state', STATE_DTYPE),
+    ('reward', np.float64),
+    ('crashed', np.bool_)
+])
+
+
+def encode_state(record, state):
+    """Write a state of the Dino into a structured record.
+
+    Args:
+        'record' (np.void of STATE_DTYPE): record to fill
+        'state' (dict): state of the Dino, None if no obstacle has been created yet
+    """
+    if not state:
+        record['type'] = -1
+        record['dx'] = record['dt'] = record['y'] = record['speed'] = record['config'] = 0.
+        return
+
+    record['type'] = OBSTACLE_TYPES[state['type']]
+    for key in ('dx', 'dt', 'y', 'speed', 'config'):
+        record[key] = state[key]
+
+
+def encode_states(records, states):
+    """Write a batch of states of the Dino into structured records, see 'encode_state'.
+
+    Args:
+        'records' (np.array of STATE_DTYPE): records to fill
+        'states' (list of dict): states of the Dino, None if no obstacle has been created yet
+    """
+    records['type'] = [OBSTACLE_TYPES[state['type']] if state else -1 for state in states]
+    for key in ('dx', 'dt', 'y', 'speed', 'config'):
+        records[key] = [state[key] if state else 0. for state in states]
+
+
+class TransitionLogger:
+    """Append the observed transitions to a binary log through a fixed-size buffer.
+
+    Attributes:
+        'filename' (str): name of the log file
+        'buffer' (np.array of RECORD_DTYPE): preallocated records waiting to be written
+        'n_buffered' (int): number of records in the buffer
+        'log_file' (file): log file opened in append mode
+    """
+    def __init__(self, filename, buffer_size=4096):
+        self.filename = filename
+        self.buffer = np.zeros(buffer_size, dtype=RECORD_DTYPE)
+        self.n_buffered = 0
+
+        # write the header of a new log
+        isNew = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self.log_file = open(filename, "ab")
+        if isNew:
+            self.log_file.write(LOG_MAGIC)
+        else:
+            check_header(filename)
+
+    def log(self, state, action, new_state, reward, isCrashed):
+        """Record a transition.
+
+        Args:
+            'state' (dict): previous state of the Dino
+            'action' (int): action performed
+            'new_state' (dict): new state after performing the action in the previous state
+            'reward' (float): reward observed in the new state
+            'isCrashed' (bool): whether the Game has been failed in the new state
+        """
+        record = self.buffer[self.n_buffered]
+        encode_state(record['state'], state)
+        record['action'] = action
+        encode_state(record['new_state'], new_state)
+        record['reward'] = reward
+        record['crashed'] = isCrashed
+
+        self.n_buffered += 1
+        if self.n_buffered == self.buffer.size:
+            self.flush()
+
+    def log_many(self, records):
+        """Record a batch of transitions.
+
+        Args:
+            'records' (np.array of RECORD_DTYPE): transitions to record
+        """
+        self.flush()
+        self.log_file.write(records.tobytes())
+
+    def flush(self):
+        """Write the buffered records to the log file.
+        """
+        if self.n_buffered:
+            self.log_file.write(self.buffer[:self.n_buffered].tobytes())
+            self.n_buffered = 0
+        self.log_file.flush()
+
+    def close(self):
+        """Write the buffered records and close the log file.
+        """
+        self.flush()
+        self.log_file.close()
+
+
+def check_header(filename):
+    """Check that a file is a transition log with the current record format.
+    """
+    with open(filename, "rb") as log_file:
+        magic = log_file.read(len(LOG_MAGIC))
+    if magic != LOG_MAGIC:
+        raise ValueError("{} is not a transition log with the current record format".format(filename))
+
+
+def read_transitions(filename):
+    """Memory-map a transition log.
+
+    Args:
+        'filename' (str): name of the log file
+
+    Return:
+        'records' (np.memmap of RECORD_DTYPE): logged transitions, read-only
+
+    Remarks:
+        A record partially written at the end of the log (interrupted run) is ignored.
+        The 'state' and 'new_state' fields can be given directly to 'StateBinning.indices'.
+    """
+    check_header(filename)
+    n_records = (os.path.getsize(filename) - len(LOG_MAGIC)) // RECORD_DTYPE.itemsize
+    if n_records == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+
+    return np.memmap(filename, dtype=RECORD_DTYPE, mode='r', offset=len(LOG_MAGIC), shape=(n_records,))
@@ -4,27 +4,49 @@ Authors:
     Gael Colas
 """
 
+import os
 import numpy as np
 import ujson as json
 import threading
 
+from mdp import SparseTransitions
+
+# version of the binary checkpoint format
+CHECKPOINT_VERSION = 1
+# name of the header file of a binary checkpoint
+CHECKPOINT_HEADER = "header.json"
+
 def input_thread(inputs_list):
     """Save the user inputs.
     """
     c = input()
     inputs_list.append(c)
     
-def display_info(n_sim, highscore, commands_filename):
+def display_info(n_sim, highscore, commands_filename, solve_stats=None, profiler=None, scheduler=None):
     """Display the current highscore and the current highscore.
     
     Args:
         'n_sim' (int): number of simulations played
         'highscore' (tuple of int, (human, AI)): the best score achieved by a human and an AI
         'commands_filename' (str): filename of the text file listing the commands used in the game
+        'solve_stats' (dict, default=None): statistics of the last MDP solve, see 'solvers.solve'
+        'profiler' (Profiler, default=None): latency instrumentation of the control loop
+        'scheduler' (DeadlineScheduler, default=None): fixed-rate scheduler of the time steps
     """
     simulation_text = "Simulations: {}\n".format(n_sim)
     
     score_text = "Highscore Human: {}\nHighscore AI: {}\n".format(*highscore)
+    
+    if solve_stats:
+        score_text += "Solver {solver}: {iterations} iterations, residual {residual:.4f}, {time:.3f} s\n".format(**solve_stats)
+        if 'stale_steps' in solve_stats:
+            score_text += "Policy staleness: {stale_steps} steps, {stale_time:.3f} s\n".format(**solve_stats)
+    
+    if scheduler:
+        score_text += "Ticks: {ticks}, overruns {overruns}, period {period:.4f} s, p95 latency {p95_latency:.4f} s\n".format(**scheduler.get_stats())
+    
+    if profiler:
+        score_text += "\n" + profiler.summary()
      
     with open(commands_filename, "r") as commands_file:
         commands_text = commands_file.read()
@@ -53,8 +75,11 @@ def handle_user_command(gym):
     c = inputs_list[-1]
     
     if c == "s":
-        save_agent(gym.agent, gym.args.save_filename)
+        gym.checkpoint_writer.save(gym.agent, gym.args.save_filename)
     elif c == "q":
+        gym.checkpoint_writer.wait()
+        if gym.agent.transition_logger:
+            gym.agent.transition_logger.close()
         gym.agent.dino.quit()
     elif c == "h":
         gym.isHuman = True
@@ -109,36 +134,266 @@ def update_score(highscore, highscore_filename):
     with open(highscore_filename, "w") as highscore_file:
         highscore_file.write("human {}\nai {}".format(highscore[0], highscore[1]))
         
-def save_agent(agent, out_filename):
-    """Save the agent parameters to a JSON file.
+def write_checkpoint(mdp_data, out_dirname):
+    """Write the approximate MDP parameters to a binary checkpoint.
     
     Args:
-        'agent' (AIAgent): AI agent to save
-        'out_filename' (str): name of the output file
+        'mdp_data' (dict): parameters of the approximate MDP, see 'AIAgent.initialize_mdp_data'
+        'out_dirname' (str): name of the checkpoint directory
+        
+    Remarks:
+        The checkpoint is a directory with one raw '.npy' file per array and a small JSON header describing the entries.
+        Each save writes a new generation of array files, then atomically replaces the header: an interrupted save leaves the previous checkpoint intact,
+        and the files memory-mapped by a loaded agent are never overwritten.
     """
-    with open(out_filename, "w") as out_file:
-        json.dump(agent.mdp_data, out_file)
+    os.makedirs(out_dirname, exist_ok=True)
+    header_filename = os.path.join(out_dirname, CHECKPOINT_HEADER)
     
-    print("The AI agent has been saved to: {}".format(out_filename))
+    # files of the previous generation
+    old_files = set()
+    generation = 0
+    if os.path.exists(header_filename):
+        with open(header_filename, "r") as header_file:
+            old_header = json.load(header_file)
+        old_files = set(checkpoint_files(old_header))
+        generation = old_header.get('generation', 0) + 1
     
-def load_agent(agent, in_filename):
-    """Load the saved agent parameters from a JSON file.
+    def save_array(name, array):
+        """Save an array to its own file, return the filename."""
+        filename = "{}.{}.npy".format(name, generation)
+        np.save(os.path.join(out_dirname, filename), np.asarray(array))
+        return filename
+    
+    entries = {}
+    for key, item in mdp_data.items():
+        if isinstance(item, SparseTransitions):
+            item.compact()
+            entries[key] = {
+                'type': 'sparse_transitions',
+                'num_states': item.num_states,
+                'num_actions': item.num_actions,
+                'files': {field: save_array("{}.{}".format(key, field), getattr(item, field)) for field in SparseTransitions.FIELDS}
+            }
+        elif isinstance(item, np.ndarray):
+            entries[key] = {'type': 'array', 'file': save_array(key, item)}
+        elif isinstance(item, (list, tuple)) and all(isinstance(array, np.ndarray) for array in item):
+            entries[key] = {'type': 'array_list', 'files': [save_array("{}.{}".format(key, i), array) for i, array in enumerate(item)]}
+        else:
+            entries[key] = {'type': 'value', 'value': item}
+    
+    # the header is written last and atomically: the checkpoint is complete once it is replaced
+    header = {'version': CHECKPOINT_VERSION, 'generation': generation, 'entries': entries}
+    with open(header_filename + ".tmp", "w") as header_file:
+        json.dump(header, header_file)
+    os.replace(header_filename + ".tmp", header_filename)
+    
+    # remove the files of the previous generation
+    for filename in old_files - set(checkpoint_files(header)):
+        try:
+            os.remove(os.path.join(out_dirname, filename))
+        except OSError: # still memory-mapped on some platforms
+            pass
+        
+def checkpoint_files(header):
+    """List the array files of a binary checkpoint.
     
     Args:
-        'agent' (AIAgent): AI agent to load the parameters into
-        'in_filename' (str): name of the input file
+        'header' (dict): header of the checkpoint
+        
+    Return:
+        'filenames' (list of str): names of the array files referenced by the header
+    """
+    filenames = []
+    for entry in header['entries'].values():
+        if entry['type'] == 'sparse_transitions':
+            filenames += list(entry['files'].values())
+        elif entry['type'] == 'array':
+            filenames.append(entry['file'])
+        elif entry['type'] == 'array_list':
+            filenames += entry['files']
+    return filenames
+        
+def read_checkpoint(in_dirname):
+    """Read the approximate MDP parameters from a binary checkpoint.
+    
+    Args:
+        'in_dirname' (str): name of the checkpoint directory
+        
+    Return:
+        'mdp_data' (dict): parameters of the approximate MDP
+        
+    Remarks:
+        The arrays are memory-mapped (copy-on-write): they are only read from the disk when used.
+    """
+    with open(os.path.join(in_dirname, CHECKPOINT_HEADER), "r") as header_file:
+        header = json.load(header_file)
+    
+    if header['version'] > CHECKPOINT_VERSION:
+        raise ValueError("Checkpoint version {} is not supported (latest: {})".format(header['version'], CHECKPOINT_VERSION))
+    
+    def load_array(filename):
+        """Memory-map an array file."""
+        return np.load(os.path.join(in_dirname, filename), mmap_mode='c')
+    
+    mdp_data = {}
+    for key, entry in header['entries'].items():
+        if entry['type'] == 'sparse_transitions':
+            arrays = {field: load_array(filename) for field, filename in entry['files'].items()}
+            mdp_data[key] = SparseTransitions.from_arrays(entry['num_states'], entry['num_actions'], **arrays)
+        elif entry['type'] == 'array':
+            mdp_data[key] = load_array(entry['file'])
+        elif entry['type'] == 'array_list':
+            mdp_data[key] = [load_array(filename) for filename in entry['files']]
+        else:
+            mdp_data[key] = entry['value']
+    
+    return mdp_data
+    
+def read_json_save(in_filename):
+    """Read the approximate MDP parameters from a JSON file saved by older versions.
+    
+    Args:
+        'in_filename' (str): name of the JSON file
+        
+    Return:
+        'mdp_data' (dict): parameters of the approximate MDP
     """
     with open(in_filename, "r") as in_file:
         mdp_data = json.load(in_file)
     
+    # sparse transition counts (the oldest saves store dense counts)
+    if isinstance(mdp_data['transition_counts'], dict):
+        transition_counts = SparseTransitions.from_dict(mdp_data['transition_counts'])
+    else:
+        transition_counts = SparseTransitions.from_dense(mdp_data['transition_counts'])
+    
     # convert all the list to np.arrays
-    agent.mdp_data = {
+    mdp_data = {
         'num_states': mdp_data['num_states'],
         'state_discretization': [np.array(states_list) for states_list in mdp_data['state_discretization']],
-        'transition_counts': np.array(mdp_data['transition_counts']),
-        'transition_probs': np.array(mdp_data['transition_probs']),
+        'transition_counts': transition_counts,
         'reward_counts': np.array(mdp_data['reward_counts']),
         'reward': np.array(mdp_data['reward']),
         'value': np.array(mdp_data['value'])
     }
+    return mdp_data
+        
+def snapshot_mdp_data(mdp_data):
+    """Take a consistent snapshot of the approximate MDP parameters, to be saved while the agent keeps learning.
+    
+    Args:
+        'mdp_data' (dict): parameters of the approximate MDP
+        
+    Return:
+        'snapshot' (dict): copy of the parameters
+        
+    Remarks:
+        The transitions are copied with their buffered transitions, which are compacted by 'write_checkpoint' on the writer thread:
+        the buffered transitions of the agent are kept for its next update of the MDP estimates.
+        Only the small arrays updated in place (rewards, value) are copied, the compacted transition arrays are shared.
+    """
+    snapshot = {}
+    for key, item in mdp_data.items():
+        if isinstance(item, SparseTransitions):
+            snapshot[key] = item.copy()
+        elif isinstance(item, np.ndarray):
+            snapshot[key] = item.copy()
+        elif isinstance(item, list):
+            snapshot[key] = [np.copy(array) for array in item]
+        else:
+            snapshot[key] = item
+    return snapshot
+    
+    
+class CheckpointWriter:
+    """Save the agent parameters on a background thread, without blocking the training loop.
+    
+    Attributes:
+        'pending' (tuple, (mdp_data, out_dirname)): last snapshot waiting to be written, None if there is none
+        'busy' (bool): whether a snapshot is being written
+        'condition' (threading.Condition): lock protecting 'pending' and 'busy'
+        'thread' (threading.Thread): background writer thread, started on the first save
+        
+    Remarks:
+        If several saves are requested while a snapshot is being written, only the last one is written.
+    """
+    def __init__(self):
+        self.pending = None
+        self.busy = False
+        self.condition = threading.Condition()
+        self.thread = None
+        
+    def save(self, agent, out_dirname):
+        """Snapshot the agent parameters and schedule their writing.
+        
+        Args:
+            'agent' (AIAgent): AI agent to save
+            'out_dirname' (str): name of the checkpoint directory
+        """
+        snapshot = snapshot_mdp_data(agent.mdp_data)
+        with self.condition:
+            self.pending = (snapshot, out_dirname)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+            
+    def run(self):
+        """Write the scheduled snapshots.
+        """
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                mdp_data, out_dirname = self.pending
+                self.pending = None
+                self.busy = True
+                
+            try:
+                write_checkpoint(mdp_data, out_dirname)
+                print("The AI agent has been saved to: {}".format(out_dirname))
+            except Exception as error:
+                print("The AI agent could not be saved to {}: {}".format(out_dirname, error))
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+                    
+    def wait(self):
+        """Wait until all the scheduled snapshots are written.
+        """
+        with self.condition:
+            while self.pending is not None or self.busy:
+                self.condition.wait()
+        
+        
+def save_agent(agent, out_dirname):
+    """Save the agent parameters to a binary checkpoint.
+    
+    Args:
+        'agent' (AIAgent): AI agent to save
+        'out_dirname' (str): name of the checkpoint directory
+    """
+    write_checkpoint(agent.mdp_data, out_dirname)
+    
+    print("The AI agent has been saved to: {}".format(out_dirname))
+    
+def load_agent(agent, in_filename):
+    """Load the saved agent parameters from a binary checkpoint, or from a JSON file saved by older versions.
+    
+    Args:
+        'agent' (AIAgent): AI agent to load the parameters into
+        'in_filename' (str): name of the checkpoint directory or of the JSON file
+
+    Remarks:
+        If there is no checkpoint directory 'in_filename', the JSON file '<in_filename>.json' of the former default name is loaded.
+    """
+    if os.path.isdir(in_filename):
+        agent.set_mdp_data(read_checkpoint(in_filename))
+    else:
+        # JSON file saved with the former default name, without the extension
+        if not os.path.exists(in_filename) and os.path.exists(in_filename + '.json'):
+            in_filename += '.json'
+        agent.set_mdp_data(read_json_save(in_filename))
+    
     print("The AI agent has been loaded from: {}".format(in_filename))